@@ -12,6 +12,10 @@ from openpyxl import Workbook
 from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
 from openpyxl.utils import get_column_letter
 import random
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from statistics import stdev
 # The 'drive' import is specific to Google Colab.
 # If running locally, you might need to comment it out and adjust file paths.
@@ -67,6 +71,29 @@ SCHEDULE_SOURCES = {
     },
 }
 
+# สีประจำกลุ่มเวร (prefix ของรหัสเวร) ใช้ร่วมกันทั้ง Daily Summary และ Signature Sheet
+SHIFT_PREFIX_COLORS = {
+    'I100': 'FF00B050',
+    'O100': 'FF00B0F0',
+    'Care': 'FFD40202',
+    'C8': 'FFE6B8AF',
+    'I400': 'FFFF00FF',
+    'O400F1': 'FF0033CC',
+    'O400F2': 'FFC78AF2',
+    'O400ER': 'FFED7D31',
+    'ARI': 'FF7030A0',
+    'Refill': 'FF741b47',
+}
+# เรียง Prefix จากยาวไปสั้น เพื่อให้เช็ค O400F1, O400F2 ก่อน O400 ธรรมดา
+SHIFT_PREFIXES_LONGEST_FIRST = tuple(sorted(SHIFT_PREFIX_COLORS, key=len, reverse=True))
+
+# openpyxl style เป็น immutable ใช้ instance เดียวร่วมกันได้ทุก cell
+UNFILLED_FILL = PatternFill(start_color='FFFFFF00', fill_type='solid')
+BOLD_FONT = Font(bold=True)
+
+# ค่าในช่องตารางที่ไม่ใช่ชื่อคน
+PLACEHOLDER_VALUES = frozenset({'NO SHIFT', 'UNFILLED', 'UNASSIGNED'})
+
 
 def ask_int_input(prompt_text, default_value, min_value=None, max_value=None):
     while True:
@@ -122,6 +149,38 @@ def ask_schedule_source():
         print("กรุณาเลือกเฉพาะ 1 หรือ 2")
 
 
+_WORKER_SCHEDULER = None
+
+
+def _init_optimize_worker(scheduler):
+    """initializer ของ worker process: รับ scheduler ครั้งเดียวต่อ process (fork ไม่ต้อง pickle)"""
+    global _WORKER_SCHEDULER
+    _WORKER_SCHEDULER = scheduler
+
+
+def _run_optimize_chunk(year, month, iteration_numbers, true_random_override, total_iterations, seed):
+    """
+    Worker ของ ProcessPoolExecutor: รัน iterations ชุดหนึ่งใน process แยก
+    seed แยกต่อ worker เพื่อไม่ให้ทุก process ที่ fork มาสุ่มลำดับเดียวกัน
+    """
+    scheduler = _WORKER_SCHEDULER
+    random.seed(seed)
+    np.random.seed(seed)
+    scheduler.run_logs = []
+    best_schedule, best_unfilled_info, best_metrics = scheduler._run_optimize_iterations(
+        year, month, iteration_numbers, true_random_override, total_iterations
+    )
+    return best_schedule, best_unfilled_info, best_metrics, scheduler.run_logs
+
+
+def _run_optimize_dates_chunk(dates_to_schedule, iteration_numbers, total_iterations, seed):
+    """Worker ของ optimize_schedule_for_dates(workers > 1): รัน iterations ชุดหนึ่งด้วย seed ของตัวเอง"""
+    scheduler = _WORKER_SCHEDULER
+    random.seed(seed)
+    np.random.seed(seed)
+    return scheduler._run_optimize_iterations_for_dates(dates_to_schedule, iteration_numbers, total_iterations)
+
+
 class PharmacistScheduler:
     """
     Pharmacy shift scheduler with optimization and Excel export.
@@ -139,6 +198,20 @@ class PharmacistScheduler:
     W_MONTH_SEGMENT_BALANCE = 180
     W_WEEKEND_OFF_PROTECTION = 2200
 
+    # น้ำหนักของ metrics ใน is_schedule_better (ใช้เมื่อจำนวนเวรว่างเท่ากัน)
+    SCHEDULE_SCORE_WEIGHTS = {
+        'preference_score': 1.0,
+        'preference_variance': 50.0,
+        'hour_imbalance_penalty': 25.0,
+        'night_variance': 800.0,
+        'weekend_off_variance': 1000.0,
+        'weekend_min_off_shortfall': 5000.0,
+        'month_segment_variance': 2500.0,
+    }
+
+    # Local search หลังจัดแบบ greedy: จำนวนรอบสูงสุดที่ไล่สลับคนในวันเดียวกันเพื่อลด preference penalty
+    LOCAL_SEARCH_PASSES = 2
+
     def __init__(self, excel_file_path, employee_sheet_name='employee', staff_type='เภสัชกร'):
         self.pharmacists = {}
         self.shift_types = {}
@@ -162,8 +235,10 @@ class PharmacistScheduler:
 
         }
 
-        self.read_data_from_excel(self.excel_file_path)
-        self.load_historical_scores()
+        # เปิด workbook ครั้งเดียว แล้วให้ทุกชีตอ่านจาก ExcelFile เดียวกัน (ไม่ parse zip/XML ซ้ำทุกชีต)
+        with pd.ExcelFile(self.excel_file_path, engine='openpyxl') as workbook:
+            self.read_data_from_excel(workbook)
+            self.load_historical_scores(workbook)
         self._calculate_preference_multipliers()
 
         self.night_shifts = {
@@ -176,6 +251,65 @@ class PharmacistScheduler:
             self.pharmacists[pharmacist]['shift_counts'] = {
                 shift_type: 0 for shift_type in self.shift_types
             }
+        self._build_eligibility_tables()
+
+    def _build_eligibility_tables(self):
+        """
+        สร้างตาราง lookup ที่ไม่เปลี่ยนระหว่างการจัดเวร (คำนวณครั้งเดียวหลังโหลดข้อมูล)
+        - required_skill_lists[shift_type]: tuple ของ skill ที่เวรต้องการ (strip + lower แล้ว)
+        - skill_eligible[shift_type]: set ของคนที่มี skill ครบตามเวร
+        - shift_minutes[shift_type]: (start, end) เป็นนาทีนับจากเที่ยงคืน (end ข้ามวันบวก 24 ชม.แล้ว)
+        - restricted_next_shifts[shift_type]: frozenset ของเวรที่ห้ามต่อในวันถัดไป
+        - max_hours[pharmacist]: เพดานชั่วโมงต่อเดือน
+        - shift_categories[shift_type]: 'Night' / 'Mixing' / None ตาม _get_shift_category
+        - category_limits[category]: {pharmacist: จำนวนเวรสูงสุด} จาก shift_limits (เฉพาะคนที่มีเพดาน)
+        - overlapping_shifts[shift_type]: set ของเวรที่เวลาทับกัน (รวมตัวเอง)
+        - junior_staff: set ของคนที่เป็น junior
+        - mixing_experts: set ของคนที่มี skill 'mixing_expert'
+        - holiday_sets[pharmacist]: frozenset ของวันลา 'YYYY-MM-DD' (อ้างอิงชุดเดียวกับ pharmacists[p]['holidays'])
+        """
+        normalized_skills = {
+            p: {skill.strip().lower() for skill in info['skills']}
+            for p, info in self.pharmacists.items()
+        }
+        self.junior_staff = {p for p, skills in normalized_skills.items() if 'junior' in skills}
+        self.mixing_experts = {p for p, info in self.pharmacists.items() if 'mixing_expert' in info['skills']}
+        self.holiday_sets = {p: info['holidays'] for p, info in self.pharmacists.items()}
+
+        self.max_hours = {p: info.get('max_hours', 250) for p, info in self.pharmacists.items()}
+        self.restricted_next_shifts = {
+            shift_type: frozenset(info.get('restricted_next_shifts', []))
+            for shift_type, info in self.shift_types.items()
+        }
+        self.shift_minutes = {
+            shift_type: self._shift_interval_minutes(info['start_time'], info['end_time'])
+            for shift_type, info in self.shift_types.items()
+        }
+        self.shift_categories = {shift_type: self._get_shift_category(shift_type) for shift_type in self.shift_types}
+        self.category_limits = {}
+        for pharmacist, limits in self.shift_limits.items():
+            for category, limit in limits.items():
+                self.category_limits.setdefault(category, {})[pharmacist] = limit
+
+        self.required_skill_lists = {
+            shift_type: tuple(str(skill).strip().lower() for skill in info['required_skills'] if str(skill).strip())
+            for shift_type, info in self.shift_types.items()
+        }
+
+        self.skill_eligible = {}
+        self.overlapping_shifts = {}
+        for shift_type in self.shift_types:
+            required = set(self.required_skill_lists[shift_type])
+            self.skill_eligible[shift_type] = {p for p, skills in normalized_skills.items() if required <= skills}
+            start, end = self.shift_minutes[shift_type]
+            self.overlapping_shifts[shift_type] = {
+                other for other, (other_start, other_end) in self.shift_minutes.items()
+                if start < other_end and end > other_start
+            }
+
+    def _count_staff_on_leave(self):
+        """{'YYYY-MM-DD': จำนวนคนที่ลาวันนั้น} นับจาก holiday_sets ครั้งเดียว แทนการไล่ทุกคนทุกวัน"""
+        return Counter(date_str for holidays in self.holiday_sets.values() for date_str in holidays)
 
     def _pre_check_staffing_levels(self, year, month):
         print("\nRunning pre-check for staffing levels (including all shifts + 3 buffer)...")
@@ -183,10 +317,10 @@ class PharmacistScheduler:
         end_date = datetime(year, month + 1, 1) - timedelta(days=1) if month < 12 else datetime(year, 12, 31)
         dates = pd.date_range(start_date, end_date)
 
+        on_leave_counts = self._count_staff_on_leave()
         all_ok = True
         for date in dates:
-            available_pharmacists_count = sum(1 for p_name, p_info in self.pharmacists.items()
-                                              if date.strftime('%Y-%m-%d') not in p_info['holidays'])
+            available_pharmacists_count = len(self.pharmacists) - on_leave_counts[self.get_date_str(date)]
             required_shifts_base = sum(1 for st in self.shift_types
                                        if self.is_shift_available_on_date(st, date))
             total_required_shifts_with_buffer = required_shifts_base + 5
@@ -204,12 +338,13 @@ class PharmacistScheduler:
         return not all_ok
 
 
-    def load_historical_scores(self):
+    def load_historical_scores(self, workbook=None):
         try:
             print("Attempting to load historical scores from sheet 'HistoricalScores'...")
-            df = pd.read_excel(self.excel_file_path, sheet_name='HistoricalScores')
+            source = workbook if workbook is not None else self.excel_file_path
+            df = pd.read_excel(source, sheet_name='HistoricalScores')
             if 'Pharmacist' in df.columns and 'Total Preference Score' in df.columns:
-                for _, row in df.iterrows():
+                for row in df.to_dict('records'):
                     pharmacist = row['Pharmacist']
                     score = row['Total Preference Score']
                     if pharmacist in self.pharmacists:
@@ -334,38 +469,144 @@ class PharmacistScheduler:
                 count += 1
         return count
 
-    def calculate_weekend_min_off_violations(self, schedule):
+    def _summarize_schedule_dict(self, schedule_dict, date):
+        """
+        สรุปตัวเลขของทุกคนจาก schedule_dict ในรอบเดียว (แทนการสแกนทั้งเดือนซ้ำต่อ candidate)
+        ผลลัพธ์ตรงกับ get_total_shift_count_in_schedule_dict / get_dept_shift_count /
+        get_month_segment_shift_count / get_weekend_days_worked_until ของแต่ละคน
+        """
+        target_segment = self.get_month_segment(date)
+        department_of = {shift_type: self.get_department_from_shift(shift_type) for shift_type in self.shift_types}
+        total_counts = Counter()
+        department_counts = Counter()
+        segment_day_counts = Counter()
+        weekend_day_counts = Counter()
+        total_weekend_days = 0
+        for d, shifts in schedule_dict.items():
+            total_counts.update(shifts.values())
+            for shift_type, assigned in shifts.items():
+                department = department_of.get(shift_type)
+                if department:
+                    department_counts[(assigned, department)] += 1
+            workers_on_day = set(shifts.values())
+            if self.get_month_segment(d) == target_segment:
+                segment_day_counts.update(workers_on_day)
+            if d.weekday() >= 5:
+                total_weekend_days += 1
+                weekend_day_counts.update(workers_on_day)
+        return {
+            'total': total_counts,
+            'department': department_counts,
+            'segment_days': segment_day_counts,
+            'weekend_days': weekend_day_counts,
+            'total_weekend_days': total_weekend_days,
+        }
+
+    def _variance(self, values):
+        """np.var ของค่าใน dict.values() โดยอ่านเข้า float ndarray ตรง ๆ (ไม่สร้าง list กลางทาง)"""
+        return np.fromiter(values, dtype=float, count=len(values)).var()
+
+    def _schedule_day_sets(self, schedule):
+        """{date: set ของค่าทุกช่องในวันนั้น} สแกน DataFrame ครั้งเดียวให้ metrics หลายตัวใช้ร่วมกัน"""
+        return {d: set(row) for d, row in zip(schedule.index, schedule.to_numpy().tolist())}
+
+    def _shift_processing_orders(self, shuffled_shifts):
+        """
+        แบ่งเวรที่สุ่มลำดับแล้วเป็นกลุ่ม night / mixing (C8) / care / other ในรอบเดียว (คงลำดับสุ่มในแต่ละกลุ่ม)
+        คืน (standard_shift_order, problem_day_shift_order)
+        """
+        buckets = {'night': [], 'mixing': [], 'care': [], 'other': []}
+        for shift_type in shuffled_shifts:
+            if shift_type in self.night_shifts:
+                buckets['night'].append(shift_type)
+            elif shift_type.startswith('C8'):
+                buckets['mixing'].append(shift_type)
+            elif shift_type.startswith('Care'):
+                buckets['care'].append(shift_type)
+            else:
+                buckets['other'].append(shift_type)
+        standard_shift_order = buckets['night'] + buckets['mixing'] + buckets['care'] + buckets['other']
+        problem_day_shift_order = buckets['mixing'] + buckets['care'] + buckets['night'] + buckets['other']
+        return standard_shift_order, problem_day_shift_order
+
+    def _schedule_dict_to_frame(self, schedule_dict):
+        """
+        schedule_dict {date: {shift_code: ค่า}} -> DataFrame (แถว = วันตามลำดับใน dict, คอลัมน์ = self.shift_types)
+        สร้างจาก list ของแถวครั้งเดียว ช่องที่ไม่มีค่าเป็น 'NO SHIFT' (แทน from_dict + reindex + fillna)
+        """
+        columns = list(self.shift_types)
+        rows = [[row.get(shift_type, 'NO SHIFT') for shift_type in columns] for row in schedule_dict.values()]
+        return pd.DataFrame(rows, index=list(schedule_dict), columns=columns)
+
+    def _schedule_assignment_index(self, schedule):
+        """{(pharmacist, date): [shift_code, ...]} เรียงตามลำดับคอลัมน์ สแกน DataFrame ครั้งเดียวให้ daily summary ใช้"""
+        assignments = {}
+        columns = schedule.columns.tolist()
+        for d, row in zip(schedule.index, schedule.to_numpy().tolist()):
+            for shift_type, p in zip(columns, row):
+                if p in self.pharmacists:
+                    assignments.setdefault((p, d), []).append(shift_type)
+        return assignments
+
+    def _schedule_hours_and_preference(self, schedule):
+        """
+        นับคนต่อคอลัมน์เวรครั้งเดียว แล้วคืน ({pharmacist: ชั่วโมงรวม}, {pharmacist: preference penalty})
+        ผลเท่ากับ calculate_total_hours / calculate_preference_penalty ทีละคน
+        """
+        values = schedule.to_numpy()
+        hours = {p: 0 for p in self.pharmacists}
+        preference_penalties = {p: 0 for p in self.pharmacists}
+        for col, shift_type in enumerate(schedule.columns):
+            shift_hours = self.shift_types[shift_type]['hours'] if shift_type in self.shift_types else None
+            for person, count in Counter(values[:, col].tolist()).items():
+                if person not in hours:
+                    continue
+                if shift_hours is not None:
+                    hours[person] += shift_hours * count
+                preference_penalties[person] += self.get_preference_score(person, shift_type) * count
+        return hours, preference_penalties
+
+    def calculate_weekend_min_off_violations(self, schedule, day_sets=None):
         """
         ตรวจสอบหลังจัดว่าใครมีวันหยุดเสาร์-อาทิตย์น้อยกว่า MIN_WEEKEND_OFF_DAYS
         คืนค่า dict: {pharmacist: shortfall}
         """
+        if day_sets is None:
+            day_sets = self._schedule_day_sets(schedule)
         weekend_dates = [d for d in schedule.index if d.weekday() >= 5]
         violations = {}
         for pharmacist in self.pharmacists:
             off_count = 0
             for d in weekend_dates:
-                if pharmacist not in schedule.loc[d].values:
+                if pharmacist not in day_sets[d]:
                     off_count += 1
             shortfall = max(0, self.MIN_WEEKEND_OFF_DAYS - off_count)
             if shortfall > 0:
                 violations[pharmacist] = shortfall
         return violations
 
-    def calculate_month_segment_variance(self, schedule):
+    def calculate_month_segment_variance(self, schedule, day_sets=None):
         """
         วัดความกระจุกของเวรตามช่วงต้น/กลาง/ปลายเดือน
         ค่ายิ่งต่ำ = เวรของแต่ละคนกระจายตามเดือนดีกว่า
         """
-        variances = []
-        for pharmacist in self.pharmacists:
-            counts = {'early': 0, 'middle': 0, 'late': 0}
-            for d in schedule.index:
-                if pharmacist in schedule.loc[d].values:
-                    counts[self.get_month_segment(d)] += 1
-            variances.append(np.var(list(counts.values())))
-        return float(np.mean(variances)) if variances else 0
+        if day_sets is None:
+            day_sets = self._schedule_day_sets(schedule)
+        segment_col = {'early': 0, 'middle': 1, 'late': 2}
+        segments = [(day_sets[d], segment_col[self.get_month_segment(d)]) for d in schedule.index]
+        if not self.pharmacists:
+            return 0
+        # เมทริกซ์ (คน x ช่วงเดือน) แล้วหา variance ทีละแถวด้วย numpy ครั้งเดียว
+        counts = np.zeros((len(self.pharmacists), 3))
+        for row, pharmacist in enumerate(self.pharmacists):
+            for day_set, col in segments:
+                if pharmacist in day_set:
+                    counts[row, col] += 1
+        return float(np.mean(np.var(counts, axis=1)))
 
     def read_data_from_excel(self, file_path):
+        # file_path รับได้ทั้ง path และ pd.ExcelFile ที่เปิดไว้แล้ว (pd.read_excel ใช้ได้ทั้งสองแบบ)
+        # วนแถวด้วย to_dict('records') แทน iterrows() เพื่อไม่ต้องสร้าง Series ใหม่ทุกแถว
         # 1. โหลดข้อมูล Skill Group จากชีต 'Skill subset'
         skill_groups_map = {}
         try:
@@ -374,7 +615,7 @@ class PharmacistScheduler:
 
             # ตรวจสอบว่ามีคอลัมน์ที่ต้องการหรือไม่
             if 'Group Name' in subset_df.columns and 'Skills' in subset_df.columns:
-                for _, row in subset_df.iterrows():
+                for row in subset_df.to_dict('records'):
                     group_name = str(row['Group Name']).strip()
                     if group_name and group_name != 'nan':
                         # แยก Skill ด้วย comma และลบช่องว่างหน้าหลัง
@@ -393,7 +634,7 @@ class PharmacistScheduler:
         self.pharmacists = {}
         self.employee_order = []
         self.no_preference_staff = set()
-        for _, row in pharmacists_df.iterrows():
+        for row in pharmacists_df.to_dict('records'):
             name = str(row['Name']).strip()
             if not name or name.lower() == 'nan':
                 continue
@@ -423,10 +664,11 @@ class PharmacistScheduler:
             if no_preference:
                 self.no_preference_staff.add(name)
 
+            # skills / holidays เก็บเป็น frozenset ตั้งแต่ตอนอ่าน ทุกจุดที่เช็ค `in` จะเป็น O(1)
             self.pharmacists[name] = {
                 'night_shift_count': 0,
-                'skills': list(expanded_skills),
-                'holidays': [date for date in str(row.get('Holidays', '')).split(',') if date != '1900-01-00' and date.strip() and date != 'nan'],
+                'skills': frozenset(expanded_skills),
+                'holidays': frozenset(date for date in str(row.get('Holidays', '')).split(',') if date != '1900-01-00' and date.strip() and date != 'nan'),
                 'shift_counts': {},
                 'preferences': preferences,
                 'no_preference': no_preference,
@@ -437,7 +679,7 @@ class PharmacistScheduler:
         shifts_df = pd.read_excel(file_path, sheet_name='Shifts')
         # ...
         self.shift_types = {}
-        for _, row in shifts_df.iterrows():
+        for row in shifts_df.to_dict('records'):
             shift_code = row['Shift Code']
             self.shift_types[shift_code] = {
                 'description': row['Description'],
@@ -450,25 +692,23 @@ class PharmacistScheduler:
             }
         departments_df = pd.read_excel(file_path, sheet_name='Departments')
         self.departments = {}
-        for _, row in departments_df.iterrows():
+        for row in departments_df.to_dict('records'):
             department = row['Department']
             self.departments[department] = row['Shift Codes'].split(',')
         pre_assign_df = pd.read_excel(file_path, sheet_name='PreAssignments')
         pre_assign_df['Date'] = pd.to_datetime(pre_assign_df['Date']).dt.strftime('%Y-%m-%d')
         self.pre_assignments = {}
-        for pharmacist, group in pre_assign_df.groupby('Pharmacist'):
-            date_dict = {}
-            for date, g in group.groupby('Date'):
-                shifts = []
-                for shift_str in g['Shift']:
-                    shifts.extend([s.strip() for s in str(shift_str).split(',') if s.strip()])
-                date_dict[date] = shifts
-            self.pre_assignments[pharmacist] = date_dict
+        # ไล่ records รอบเดียว (เรียงตาม Pharmacist, Date แบบ stable ให้ลำดับเท่ากับ groupby ซ้อนสองชั้นเดิม)
+        pre_assign_df = pre_assign_df.dropna(subset=['Pharmacist', 'Date'])
+        pre_assign_df = pre_assign_df.sort_values(['Pharmacist', 'Date'], kind='stable')
+        for row in pre_assign_df.to_dict('records'):
+            shifts = self.pre_assignments.setdefault(row['Pharmacist'], {}).setdefault(row['Date'], [])
+            shifts.extend([s.strip() for s in str(row['Shift']).split(',') if s.strip()])
 
         try:
             print("Attempting to load special notes from sheet 'SpecialNotes'...")
             notes_df = pd.read_excel(file_path, sheet_name='SpecialNotes', index_col=0)
-            for pharmacist, row_data in notes_df.iterrows():
+            for pharmacist, row_data in zip(notes_df.index, notes_df.to_dict('records')):
                 if pharmacist in self.pharmacists:
                     for date_col, note in row_data.items():
                         if pd.notna(note) and str(note).strip():
@@ -485,7 +725,7 @@ class PharmacistScheduler:
         try:
             print("Attempting to load shift limits from sheet 'ShiftLimits'...")
             limits_df = pd.read_excel(file_path, sheet_name='ShiftLimits')
-            for _, row in limits_df.iterrows():
+            for row in limits_df.to_dict('records'):
                 pharmacist = row['Pharmacist']
                 category = row['ShiftCategory']
                 max_count = row['MaxCount']
@@ -503,7 +743,7 @@ class PharmacistScheduler:
         try:
             print("Attempting to load minimum shift requirements from sheet 'MinShiftRequirements'...")
             min_req_df = pd.read_excel(file_path, sheet_name='MinShiftRequirements')
-            for _, row in min_req_df.iterrows():
+            for row in min_req_df.to_dict('records'):
                 pharmacist = str(row['Pharmacist']).strip()
                 department = str(row['Department']).strip()
                 min_count  = int(row['MinCount'])
@@ -528,39 +768,67 @@ class PharmacistScheduler:
             raise ValueError("Invalid input type. Expected string (HH:MM) or datetime.time object.")
         return hours * 60 + minutes
 
+    def _shift_interval_minutes(self, start, end):
+        start_mins = self.convert_time_to_minutes(start)
+        end_mins = self.convert_time_to_minutes(end)
+        if end_mins < start_mins: end_mins += 24 * 60
+        return start_mins, end_mins
+
     def check_time_overlap(self, start1, end1, start2, end2):
-        start1_mins = self.convert_time_to_minutes(start1)
-        end1_mins = self.convert_time_to_minutes(end1)
-        start2_mins = self.convert_time_to_minutes(start2)
-        end2_mins = self.convert_time_to_minutes(end2)
-        if end1_mins < start1_mins: end1_mins += 24 * 60
-        if end2_mins < start2_mins: end2_mins += 24 * 60
+        start1_mins, end1_mins = self._shift_interval_minutes(start1, end1)
+        start2_mins, end2_mins = self._shift_interval_minutes(start2, end2)
         return start1_mins < end2_mins and end1_mins > start2_mins
 
-    def check_mixing_expert_ratio_optimized(self, schedule_dict, date, current_shift=None, current_pharm=None):
-        mixing_shifts = [p for s, p in schedule_dict[date].items()
-                         if s.startswith('C8') and p not in ['NO SHIFT', 'UNASSIGNED', 'UNFILLED']]
-        if current_shift and current_shift.startswith('C8') and current_pharm:
-            mixing_shifts.append(current_pharm)
-        if not mixing_shifts: return True
-        total_mixing = len(mixing_shifts)
-        expert_count = sum(1 for pharm in mixing_shifts
-                           if pharm in self.pharmacists and 'mixing_expert' in self.pharmacists[pharm]['skills'])
+    def _mixing_expert_tally(self, schedule_dict, date):
+        """คืน (จำนวนเวร C8 ที่มีคนแล้ว, จำนวนที่เป็น mixing_expert) ของวันนั้น"""
+        total_mixing = 0
+        expert_count = 0
+        for s, p in schedule_dict[date].items():
+            if s.startswith('C8') and p not in PLACEHOLDER_VALUES:
+                total_mixing += 1
+                if p in self.mixing_experts:
+                    expert_count += 1
+        return total_mixing, expert_count
+
+    def _mixing_expert_ratio_ok(self, tally, current_pharm=None):
+        total_mixing, expert_count = tally
+        if current_pharm:
+            total_mixing += 1
+            if current_pharm in self.mixing_experts:
+                expert_count += 1
+        if not total_mixing: return True
         return expert_count >= (2 * total_mixing / 3)
 
-    def count_consecutive_shifts(self, pharmacist, date, schedule, max_days=6):
+    def check_mixing_expert_ratio_optimized(self, schedule_dict, date, current_shift=None, current_pharm=None):
+        if not (current_shift and current_shift.startswith('C8')):
+            current_pharm = None
+        return self._mixing_expert_ratio_ok(self._mixing_expert_tally(schedule_dict, date), current_pharm)
+
+    def count_consecutive_shifts(self, pharmacist, date, schedule, max_days=6, day_sets=None):
+        # day_sets จาก _schedule_day_sets ส่งมาได้ เมื่อเรียกซ้ำหลายคนบนตารางเดิม (ไม่ต้องแปลง DataFrame ทุกครั้ง)
+        if day_sets is None:
+            day_sets = self._schedule_day_sets(schedule)
         count = 0
         current_date = date - timedelta(days=1)
         for _ in range(max_days):
-            if current_date in schedule.index and pharmacist in schedule.loc[current_date].values:
+            if current_date in day_sets and pharmacist in day_sets[current_date]:
                 count += 1
                 current_date -= timedelta(days=1)
             else:
                 break
         return count
 
+    def get_date_str(self, date):
+        """คืน 'YYYY-MM-DD' ของวันที่ (cache ไว้ เพราะถูกเรียกซ้ำทุกวัน x ทุกเวร x ทุก iteration)"""
+        if not hasattr(self, '_date_str_cache'):
+            self._date_str_cache = {}
+        date_str = self._date_str_cache.get(date)
+        if date_str is None:
+            date_str = self._date_str_cache[date] = pd.to_datetime(date).strftime('%Y-%m-%d')
+        return date_str
+
     def is_holiday(self, date):
-        return date.strftime('%Y-%m-%d') in self.holidays['specific_dates']
+        return self.get_date_str(date) in self.holidays['specific_dates']
 
     def get_dept_shift_count(self, pharmacist, department, schedule_dict):
         """
@@ -590,23 +858,36 @@ class PharmacistScheduler:
         return current_count < min_req
 
 
-    def calculate_weekend_off_variance(self, schedule, year, month):
-        weekend_off_counts = {p: 0 for p in self.pharmacists}
+    def calculate_weekend_off_variance(self, schedule, year, month, day_sets=None):
         start_date = datetime(year, month, 1)
         end_date = datetime(year, month + 1, 1) - timedelta(days=1) if month < 12 else datetime(year, 12, 31)
-        for date in pd.date_range(start_date, end_date):
-            if date.weekday() >= 5:
-                working_on_weekend = {schedule.loc[date, shift] for shift in schedule.columns if schedule.loc[date, shift] not in ['NO SHIFT', 'UNFILLED', 'UNASSIGNED']}
-                for p_name in self.pharmacists:
-                    if p_name not in working_on_weekend:
-                        weekend_off_counts[p_name] += 1
+        month_dates = pd.date_range(start_date, end_date)
+        weekend_dates = month_dates[month_dates.weekday >= 5]
+        # นับว่าแต่ละคนทำงานกี่วันเสาร์-อาทิตย์ (set ต่อแถวกันนับซ้ำ 2 เวรในวันเดียว) แล้ววันหยุด = วันเสาร์-อาทิตย์ทั้งหมด - วันที่ทำ
+        if day_sets is None:
+            weekend_sets = [set(row) for row in schedule.loc[weekend_dates].to_numpy().tolist()]
+        else:
+            weekend_sets = [day_sets[date] for date in weekend_dates]
+        weekend_worked = Counter()
+        for workers_on_day in weekend_sets:
+            weekend_worked.update(workers_on_day)
+        weekend_off_counts = {p: len(weekend_sets) - weekend_worked[p] for p in self.pharmacists}
         if len(weekend_off_counts) > 1:
-            return np.var(list(weekend_off_counts.values()))
+            return self._variance(weekend_off_counts.values())
         return 0
 
     def is_night_shift(self, shift_type):
         return shift_type in self.night_shifts
 
+    def get_shift_hour_label(self, shift_type):
+        """ค่าที่แสดงใน Daily Summary: ชั่วโมงเป็น int หรือ '<ชั่วโมง>N' สำหรับเวรดึก (cache ต่อ scheduler)"""
+        if not hasattr(self, '_shift_hour_label_cache'):
+            self._shift_hour_label_cache = {
+                st: f"{int(info['hours'])}N" if self.is_night_shift(st) else int(info['hours'])
+                for st, info in self.shift_types.items()
+            }
+        return self._shift_hour_label_cache[shift_type]
+
     def _get_holiday_blocks(self, year, month):
         """
         คำนวณ block วันหยุดยาวทั้งหมดในเดือน
@@ -662,6 +943,16 @@ class PharmacistScheduler:
 
 
     def is_shift_available_on_date(self, shift_type, date):
+        # ผลขึ้นกับ shift_type + วันที่เท่านั้น (holidays ตั้งครั้งเดียวใน __init__) จึง cache ไว้ใช้ซ้ำทุก iteration
+        if not hasattr(self, '_shift_available_cache'):
+            self._shift_available_cache = {}
+        key = (shift_type, date)
+        cached = self._shift_available_cache.get(key)
+        if cached is None:
+            cached = self._shift_available_cache[key] = self._compute_shift_available_on_date(shift_type, date)
+        return cached
+
+    def _compute_shift_available_on_date(self, shift_type, date):
         shift_info = self.shift_types[shift_type]
         is_holiday_date = self.is_holiday(date)  # specific_dates เท่านั้น
 
@@ -717,6 +1008,16 @@ class PharmacistScheduler:
         return False
 
     def get_department_from_shift(self, shift_type):
+        # department ขึ้นกับรหัสเวรอย่างเดียว จึง cache ผลไว้ ไม่ต้องไล่ startswith ทุกครั้ง
+        if not hasattr(self, '_shift_department_cache'):
+            self._shift_department_cache = {}
+        try:
+            return self._shift_department_cache[shift_type]
+        except KeyError:
+            department = self._shift_department_cache[shift_type] = self._compute_department_from_shift(shift_type)
+            return department
+
+    def _compute_department_from_shift(self, shift_type):
         if shift_type.startswith('I100'): return 'IPD100'
         elif shift_type.startswith('O100'): return 'OPD100'
         elif shift_type.startswith('Care'): return 'Care'
@@ -740,6 +1041,16 @@ class PharmacistScheduler:
         return self.pharmacists[pharmacist]['night_shift_count']
 
     def get_preference_score(self, pharmacist, shift_type):
+        # skills / preferences ไม่เปลี่ยนหลังโหลดข้อมูล จึง cache rank ต่อ (pharmacist, shift_type)
+        if not hasattr(self, '_preference_score_cache'):
+            self._preference_score_cache = {}
+        key = (pharmacist, shift_type)
+        cached = self._preference_score_cache.get(key)
+        if cached is None:
+            cached = self._preference_score_cache[key] = self._compute_preference_score(pharmacist, shift_type)
+        return cached
+
+    def _compute_preference_score(self, pharmacist, shift_type):
         p_skills = [skill.strip().lower() for skill in self.pharmacists[pharmacist]['skills']]
         if 'junior' in p_skills:
             return 1  # ให้คะแนนความชอบเป็น 1 (ดีที่สุด) เสมอ เพื่อให้กระจายไปได้ทุกที่
@@ -760,19 +1071,15 @@ class PharmacistScheduler:
         if previous_date in schedule_dict:
             for prev_shift, assigned_pharm in schedule_dict[previous_date].items():
                 if assigned_pharm == pharmacist:
-                    restricted = self.shift_types[prev_shift].get('restricted_next_shifts', [])
-                    if shift_type in restricted: return True
+                    if shift_type in self.restricted_next_shifts[prev_shift]: return True
         return False
 
     def has_overlapping_shift_optimized(self, pharmacist, date, new_shift_type, schedule_dict):
         if date not in schedule_dict: return False
-        new_start = self.shift_types[new_shift_type]['start_time']
-        new_end = self.shift_types[new_shift_type]['end_time']
+        overlapping = self.overlapping_shifts[new_shift_type]
         for existing_shift, assigned_pharm in schedule_dict[date].items():
             if assigned_pharm == pharmacist and existing_shift != new_shift_type:
-                existing_start = self.shift_types[existing_shift]['start_time']
-                existing_end = self.shift_types[existing_shift]['end_time']
-                if self.check_time_overlap(new_start, new_end, existing_start, existing_end):
+                if existing_shift in overlapping:
                     return True
         return False
 
@@ -794,18 +1101,20 @@ class PharmacistScheduler:
         return shifts
 
     def calculate_total_hours(self, pharmacist, schedule):
+        # นับจำนวนครั้งต่อคอลัมน์เวรด้วย ndarray แทนการไล่ .loc ทีละวัน
+        shift_counts = (schedule.to_numpy() == pharmacist).sum(axis=0).tolist()
         total_hours = 0
-        for date in schedule.index:
-            for shift_type, assigned_pharm in schedule.loc[date].items():
-                if assigned_pharm == pharmacist and shift_type in self.shift_types:
-                    total_hours += self.shift_types[shift_type]['hours']
+        for shift_type, count in zip(schedule.columns, shift_counts):
+            if count and shift_type in self.shift_types:
+                total_hours += self.shift_types[shift_type]['hours'] * count
         return total_hours
 
-    def _get_hour_imbalance_penalty(self, hours_dict):
+    def _get_hour_imbalance_penalty(self, hours_dict, hour_stdev=None):
         if not hours_dict or len(hours_dict) < 2:
             return 0
         hour_values = list(hours_dict.values())
-        hour_stdev = stdev(hour_values)
+        if hour_stdev is None:
+            hour_stdev = stdev(hour_values)
         hour_range = max(hour_values) - min(hour_values)
         stdev_penalty = hour_stdev ** 2
         range_penalty = 0
@@ -814,29 +1123,30 @@ class PharmacistScheduler:
         return stdev_penalty + range_penalty
 
     def calculate_schedule_metrics(self, schedule, year, month):
-        hours = {p: self.calculate_total_hours(p, schedule) for p in self.pharmacists}
+        # สแกนตารางครั้งเดียวแล้วให้ทุก metric ใช้ผลร่วมกัน แทนการไล่ทั้งตารางทีละคนทีละ metric
+        hours, preference_penalties = self._schedule_hours_and_preference(schedule)
+        day_sets = self._schedule_day_sets(schedule)
         night_counts = {p: self.pharmacists[p]['night_shift_count'] for p in self.pharmacists}
-        weekend_off_var = self.calculate_weekend_off_variance(schedule, year, month)
-        hour_penalty = self._get_hour_imbalance_penalty(hours)
+        weekend_off_var = self.calculate_weekend_off_variance(schedule, year, month, day_sets)
+        # stdev ของชั่วโมงคำนวณครั้งเดียว ใช้ทั้ง penalty และค่าที่ log
+        hour_stdev = stdev(hours.values()) if len(hours) > 1 else 0
+        hour_penalty = self._get_hour_imbalance_penalty(hours, hour_stdev)
 
         # --- ADDED: คำนวณความแปรปรวนของ Preference Score (%) ---
         pref_percentages = self.calculate_pharmacist_preference_scores(schedule)
-        pref_variance = np.var(list(pref_percentages.values())) if len(pref_percentages) > 1 else 0
+        pref_variance = self._variance(pref_percentages.values()) if len(pref_percentages) > 1 else 0
 
-        weekend_min_off_violations = self.calculate_weekend_min_off_violations(schedule)
+        weekend_min_off_violations = self.calculate_weekend_min_off_violations(schedule, day_sets)
         metrics = {
             'hour_imbalance_penalty': hour_penalty,
-            'night_variance': np.var(list(night_counts.values())) if night_counts else 0,
-            'preference_score': sum(self.calculate_preference_penalty(p, schedule) for p in self.pharmacists),
+            'night_variance': self._variance(night_counts.values()) if night_counts else 0,
+            'preference_score': sum(preference_penalties.values()),
             'preference_variance': pref_variance,
             'weekend_off_variance': weekend_off_var,
             'weekend_min_off_shortfall': sum(weekend_min_off_violations.values()),
-            'month_segment_variance': self.calculate_month_segment_variance(schedule),
+            'month_segment_variance': self.calculate_month_segment_variance(schedule, day_sets),
         }
-        if len(hours) > 1:
-            metrics['hour_diff_for_logging'] = stdev(hours.values())
-        else:
-            metrics['hour_diff_for_logging'] = 0
+        metrics['hour_diff_for_logging'] = hour_stdev
         return metrics
 
     def _log_schedule_event(self, event_type, message, **kwargs):
@@ -871,6 +1181,16 @@ class PharmacistScheduler:
         True when pharmacist has all required skills for shift_type.
         Empty Required Skills means everyone can be assigned.
         """
+        # skills ไม่เปลี่ยนหลังโหลด จึง cache ผลต่อ (pharmacist, shift_type) ไม่ต้อง normalize ทุกวันทุกเวร
+        if not hasattr(self, '_required_skills_cache'):
+            self._required_skills_cache = {}
+        key = (pharmacist, shift_type)
+        cached = self._required_skills_cache.get(key)
+        if cached is None:
+            cached = self._required_skills_cache[key] = self._compute_has_required_skills(pharmacist, shift_type)
+        return cached
+
+    def _compute_has_required_skills(self, pharmacist, shift_type):
         p_skills = {
             str(skill).strip().lower()
             for skill in self.pharmacists.get(pharmacist, {}).get('skills', [])
@@ -892,7 +1212,7 @@ class PharmacistScheduler:
         2) no assignment on personal holiday/leave
         3) required skill matching
         """
-        date_str = pd.to_datetime(date).strftime('%Y-%m-%d')
+        date_str = self.get_date_str(date)
         candidates = []
 
         for pharmacist in staff_pool:
@@ -1047,7 +1367,7 @@ class PharmacistScheduler:
                     continue
 
                 # Do not overwrite PreAssignments or any existing assignment.
-                if schedule_dict[date][shift_type] not in ['NO SHIFT', 'UNASSIGNED', 'UNFILLED']:
+                if schedule_dict[date][shift_type] not in PLACEHOLDER_VALUES:
                     continue
 
                 candidates = self._get_true_random_candidates(
@@ -1110,9 +1430,7 @@ class PharmacistScheduler:
                     HoursAfter=pharmacist_hours[chosen]
                 )
 
-        final_schedule = pd.DataFrame.from_dict(schedule_dict, orient='index')
-        final_schedule = final_schedule.reindex(columns=list(self.shift_types.keys()), fill_value='NO SHIFT')
-        final_schedule.fillna('NO SHIFT', inplace=True)
+        final_schedule = self._schedule_dict_to_frame(schedule_dict)
 
         self._log_schedule_event(
             "TRUE_RANDOM_COMPLETE",
@@ -1124,6 +1442,10 @@ class PharmacistScheduler:
 
         return final_schedule, unfilled_info
 
+    def _get_processing_order_dates(self, dates):
+        """ลำดับวันที่จะจัดเวร: problem days ก่อน (เรียงตามวันที่) แล้วตามด้วยวันอื่น ๆ — sort ครั้งเดียว"""
+        return sorted(dates, key=lambda d: (d not in self.problem_days, d))
+
     def generate_monthly_schedule_shuffled(self, year, month, shuffled_shifts=None, shuffled_pharmacists=None, iteration_num=1):
         start_date = datetime(year, month, 1)
         end_date = datetime(year + 1, 1, 1) - timedelta(days=1) if month == 12 else datetime(year, month + 1, 1) - timedelta(days=1)
@@ -1131,6 +1453,7 @@ class PharmacistScheduler:
         schedule_dict = {date: {shift: 'NO SHIFT' for shift in self.shift_types} for date in dates}
         pharmacist_hours = {p: 0 for p in self.pharmacists}
         pharmacist_consecutive_days = {p: 0 for p in self.pharmacists}
+        streak_nonzero = set()  # คนที่ตัวนับวันติดต่อกันไม่เป็น 0 อยู่ (มีแค่คนเหล่านี้ที่ต้อง reset)
 
         if shuffled_shifts is None:
             shuffled_shifts = list(self.shift_types.keys())
@@ -1159,36 +1482,39 @@ class PharmacistScheduler:
                         self._update_shift_counts(pharmacist, shift_type)
                         pharmacist_hours[pharmacist] += self.shift_types[shift_type]['hours']
 
-        all_dates = list(pd.date_range(start_date, end_date))
-        problem_dates_sorted = sorted([d for d in all_dates if d in self.problem_days])
-        other_dates_sorted = sorted([d for d in all_dates if d not in self.problem_days])
-        processing_order_dates = problem_dates_sorted + other_dates_sorted
+        processing_order_dates = self._get_processing_order_dates(dates)
         unfilled_info = {'problem_days': [], 'other_days': []}
-        night_shifts_ordered = [s for s in shuffled_shifts if self.is_night_shift(s)]
-        mixing_shifts_ordered = [s for s in shuffled_shifts if s.startswith('C8') and not self.is_night_shift(s)]
-        care_shifts_ordered = [s for s in shuffled_shifts if s.startswith('Care') and not self.is_night_shift(s) and not s.startswith('C8')]
-        other_shifts_ordered = [s for s in shuffled_shifts if not self.is_night_shift(s) and not s.startswith('C8') and not s.startswith('Care')]
-        standard_shift_order = night_shifts_ordered + mixing_shifts_ordered + care_shifts_ordered + other_shifts_ordered
-        problem_day_shift_order = mixing_shifts_ordered + care_shifts_ordered + night_shifts_ordered + other_shifts_ordered
+        standard_shift_order, problem_day_shift_order = self._shift_processing_orders(shuffled_shifts)
+        # candidate ต่อเวร: เฉพาะคนที่ skill ตรง ตามลำดับสุ่มของรอบนี้ (ตัดคนที่ไม่มีทางผ่านออกก่อนเข้า filter)
+        skill_ordered_pharmacists = {
+            shift_type: [p for p in shuffled_pharmacists if p in self.skill_eligible[shift_type]]
+            for shift_type in self.shift_types
+        }
 
         for date in tqdm(processing_order_dates, desc=f"Building Schedule (Iteration {iteration_num})", leave=False):
             pharmacists_working_yesterday = set()
+            night_yesterday = set()  # คนที่อยู่เวรดึกเมื่อวาน: สแกนครั้งเดียวต่อวัน ใช้ร่วมทุกเวรของวันนี้
             previous_date = date - timedelta(days=1)
             if previous_date in schedule_dict:
-                   pharmacists_working_yesterday = {p for p in schedule_dict[previous_date].values() if p in self.pharmacists}
-            for p_name in self.pharmacists:
-                if p_name in pharmacists_working_yesterday:
-                    pharmacist_consecutive_days[p_name] += 1
-                else:
-                    pharmacist_consecutive_days[p_name] = 0
+                for prev_shift, p in schedule_dict[previous_date].items():
+                    if p in self.pharmacists:
+                        pharmacists_working_yesterday.add(p)
+                        if self.is_night_shift(prev_shift):
+                            night_yesterday.add(p)
+            # อัปเดตเฉพาะคนที่เปลี่ยน: คนทำงานเมื่อวาน +1, คนที่เคยมี streak แต่เมื่อวานว่าง reset เป็น 0
+            for p_name in pharmacists_working_yesterday:
+                pharmacist_consecutive_days[p_name] += 1
+            for p_name in streak_nonzero - pharmacists_working_yesterday:
+                pharmacist_consecutive_days[p_name] = 0
+            streak_nonzero = pharmacists_working_yesterday
 
             is_day_before_problem_day = (date + timedelta(days=1)) in self.problem_days
 
             shifts_to_process = problem_day_shift_order if date in self.problem_days else standard_shift_order
             for shift_type in shifts_to_process:
-                if schedule_dict[date][shift_type] not in ['NO SHIFT', 'UNASSIGNED', 'UNFILLED'] or not self.is_shift_available_on_date(shift_type, date):
+                if schedule_dict[date][shift_type] not in PLACEHOLDER_VALUES or not self.is_shift_available_on_date(shift_type, date):
                     continue
-                available = self._get_available_pharmacists_optimized(shuffled_pharmacists, date, shift_type, schedule_dict, pharmacist_hours, pharmacist_consecutive_days)
+                available = self._get_available_pharmacists_optimized(skill_ordered_pharmacists[shift_type], date, shift_type, schedule_dict, pharmacist_hours, pharmacist_consecutive_days, night_yesterday=night_yesterday)
                 if available:
                     chosen = self._select_best_pharmacist(available, shift_type, date, is_day_before_problem_day)
                     pharmacist_to_assign = chosen['name']
@@ -1217,10 +1543,13 @@ class PharmacistScheduler:
                         else:
                             unfilled_info['other_days'].append((date, shift_type))
 
+        # ปรับตาราง greedy ด้วย local search (สลับคนในวันเดียวกัน) ก่อนส่งไปให้คะแนน
+        swaps = self._improve_preferences_with_swaps(dates, schedule_dict, pharmacist_hours, pharmacist_consecutive_days)
+        if swaps:
+            print(f"Local search: applied {swaps} same-day preference swaps")
+
         # เมื่อจัดครบทุกวันแล้วค่อยสร้าง DataFrame
-        final_schedule = pd.DataFrame.from_dict(schedule_dict, orient='index')
-        final_schedule = final_schedule.reindex(columns=list(self.shift_types.keys()), fill_value='NO SHIFT')
-        final_schedule.fillna('NO SHIFT', inplace=True)
+        final_schedule = self._schedule_dict_to_frame(schedule_dict)
         return final_schedule, unfilled_info
 
     def _update_shift_counts(self, pharmacist, shift_type):
@@ -1234,6 +1563,18 @@ class PharmacistScheduler:
         if category and category in self.pharmacists[pharmacist]['category_counts']:
             self.pharmacists[pharmacist]['category_counts'][category] += 1
 
+    def _recount_shift_counts(self, schedule):
+        """
+        ตั้งตัวนับเวรต่อคน (night/mixing/care/category_counts) ใหม่จากตารางที่ได้
+        ใช้หลังเลือกตารางที่ดีที่สุด: ตัวนับระหว่างรันเป็นของ iteration สุดท้าย หรืออยู่ใน worker process (workers > 1)
+        """
+        self._reset_runtime_shift_counters()
+        values = schedule.to_numpy()
+        for col, shift_type in enumerate(schedule.columns):
+            for pharmacist in values[:, col].tolist():
+                if pharmacist in self.pharmacists:
+                    self._update_shift_counts(pharmacist, shift_type)
+
     def _revert_shift_counts(self, pharmacist, shift_type):
         """Undo shift counters when a pharmacist is moved out from an already assigned shift."""
         if pharmacist not in self.pharmacists or shift_type not in self.shift_types:
@@ -1260,7 +1601,7 @@ class PharmacistScheduler:
 
     def _is_preassigned_shift(self, pharmacist, date, shift_type):
         """Return True if this exact assignment came from PreAssignments and should not be moved by rescue swap."""
-        date_str = pd.to_datetime(date).strftime('%Y-%m-%d')
+        date_str = self.get_date_str(date)
         return (
             pharmacist in self.pre_assignments
             and date_str in self.pre_assignments[pharmacist]
@@ -1269,11 +1610,7 @@ class PharmacistScheduler:
 
     def _is_skill_scarce_shift(self, shift_type):
         """Shifts with specific required skills should get rescue/swap priority."""
-        required_skills = [
-            str(s).strip().lower()
-            for s in self.shift_types.get(shift_type, {}).get('required_skills', [])
-            if str(s).strip()
-        ]
+        required_skills = self.required_skill_lists.get(shift_type, ())
         return bool(required_skills) or shift_type.startswith('C8') or shift_type.startswith('Care')
 
     def _can_replace_shift_after_temp_move(
@@ -1327,12 +1664,6 @@ class PharmacistScheduler:
         if not self.is_shift_available_on_date(target_shift, date):
             return False
 
-        required_skills = [
-            str(s).strip().lower()
-            for s in self.shift_types[target_shift].get('required_skills', [])
-            if str(s).strip()
-        ]
-
         rescue_options = []
 
         # 1) หา donor: คนที่มี skill target แต่ติดเวรอื่นอยู่ในวันเดียวกัน
@@ -1341,15 +1672,14 @@ class PharmacistScheduler:
                 continue
             if old_shift == target_shift:
                 continue
-            if schedule_dict[date].get(target_shift) not in ['NO SHIFT', 'UNASSIGNED', 'UNFILLED']:
+            if schedule_dict[date].get(target_shift) not in PLACEHOLDER_VALUES:
                 continue
             if self._is_preassigned_shift(donor, date, old_shift):
                 continue
             if self.is_night_shift(old_shift):
                 continue
 
-            donor_skills = [s.strip().lower() for s in self.pharmacists[donor].get('skills', [])]
-            if required_skills and not all(skill in donor_skills for skill in required_skills):
+            if donor not in self.skill_eligible[target_shift]:
                 continue
 
             # 2) ลอง remove donor จาก old_shift ชั่วคราว เพื่อเช็กว่า donor ลง target_shift ได้จริงหรือไม่
@@ -1390,11 +1720,7 @@ class PharmacistScheduler:
                         is_day_before_problem_day
                     )
 
-                    old_shift_required_skills = [
-                        str(s).strip().lower()
-                        for s in self.shift_types[old_shift].get('required_skills', [])
-                        if str(s).strip()
-                    ]
+                    old_shift_required_skills = self.required_skill_lists[old_shift]
 
                     # ยิ่ง old_shift ใช้ skill น้อย ยิ่งเหมาะกับการถูกดึง donor ออก
                     old_shift_scarcity_penalty = 1000 if self._is_skill_scarce_shift(old_shift) else 0
@@ -1450,118 +1776,283 @@ class PharmacistScheduler:
         )
         return True
 
-    def _get_available_pharmacists_optimized(self, pharmacists, date, shift_type, schedule_dict, current_hours_dict, consecutive_days_dict):
+    def _is_swappable_shift(self, pharmacist, date, shift_type):
+        """
+        เวรที่ local search สลับคนได้: เวรกลางวันที่ไม่ใช่ C8/Care และไม่ได้มาจาก PreAssignments
+        (เวรกลุ่มนี้ไม่มีตัวนับ night/mixing/care/category ให้ต้องปรับตาม)
+        """
+        return (
+            pharmacist in self.pharmacists
+            and not self.is_night_shift(shift_type)
+            and not shift_type.startswith('C8')
+            and not shift_type.startswith('Care')
+            and not self._is_preassigned_shift(pharmacist, date, shift_type)
+        )
+
+    def _breaks_restricted_next_day(self, pharmacist, date, shift_type, schedule_dict):
+        """เวรของคนนี้ในวันถัดไป (ที่จัดไว้แล้ว) ห้ามต่อจาก shift_type หรือไม่"""
+        next_date = date + timedelta(days=1)
+        if next_date not in schedule_dict:
+            return False
+        restricted = self.restricted_next_shifts[shift_type]
+        return any(
+            assigned == pharmacist and next_shift in restricted
+            for next_shift, assigned in schedule_dict[next_date].items()
+        )
+
+    def _improve_preferences_with_swaps(self, dates, schedule_dict, pharmacist_hours, pharmacist_consecutive_days):
+        """
+        Local search หลังจัดเวรแบบ greedy เสร็จทั้งเดือน
+
+        ลองสลับคน 2 คนที่อยู่เวรกลางวันชั่วโมงเท่ากันในวันเดียวกัน (A: s1 -> s2, B: s2 -> s1)
+        - ชั่วโมง, วันทำงาน, เวรดึก, วันหยุดเสาร์-อาทิตย์ และตัวนับ night/mixing/care/category ไม่เปลี่ยน
+        - แต่ทั้งสองคนอาจย้ายแผนก ซึ่งกระทบจำนวนเวรต่อแผนกที่ MinShiftRequirements ใช้:
+          ไม่รับการสลับที่ทำให้ใครเหลือเวรในแผนกที่ย้ายออกต่ำกว่า min_shift_requirements
+        - รับการสลับเมื่อคะแนนถ่วงน้ำหนักของ preference_score + preference_variance (SCHEDULE_SCORE_WEIGHTS) ลดลงเท่านั้น
+        - ทุกการสลับต้องผ่าน _get_available_pharmacists_optimized เดิม + เช็ค restricted_next ของวันถัดไป
+        คืนจำนวนครั้งที่สลับสำเร็จ
+        """
+        MAX_POINTS_PER_SHIFT = 8
+        achieved_points = {p: 0 for p in self.pharmacists}
+        shifts_worked = {p: 0 for p in self.pharmacists}
+        # จำนวนเวรต่อ (คน, แผนก) เฉพาะคนที่มี MinShiftRequirements
+        dept_counts = Counter()
+        for date in dates:
+            for shift_type, assigned in schedule_dict[date].items():
+                if assigned in shifts_worked:
+                    shifts_worked[assigned] += 1
+                    achieved_points[assigned] += max(0, 9 - self.get_preference_score(assigned, shift_type))
+                    if assigned in self.min_shift_requirements:
+                        dept_counts[(assigned, self.get_department_from_shift(shift_type))] += 1
+
+        def leaves_below_min(pharmacist, from_dept, to_dept):
+            if from_dept == to_dept:
+                return False
+            min_req = self.min_shift_requirements.get(pharmacist, {}).get(from_dept, 0)
+            return min_req > 0 and dept_counts[(pharmacist, from_dept)] - 1 < min_req
+
+        def percentage(points, worked):
+            return (points / (worked * MAX_POINTS_PER_SHIFT)) * 100 if worked else 0
+
+        score_weight = self.SCHEDULE_SCORE_WEIGHTS['preference_score']
+        variance_weight = self.SCHEDULE_SCORE_WEIGHTS['preference_variance']
+        percentages = {p: percentage(achieved_points[p], shifts_worked[p]) for p in self.pharmacists}
+        current_variance = self._variance(percentages.values()) if len(percentages) > 1 else 0
+
+        swaps = 0
+        for _ in range(self.LOCAL_SEARCH_PASSES):
+            swaps_this_pass = 0
+            for date in dates:
+                day = schedule_dict[date]
+                slots = [
+                    (shift_type, assigned) for shift_type, assigned in day.items()
+                    if self._is_swappable_shift(assigned, date, shift_type)
+                ]
+                for i, (s1, _) in enumerate(slots):
+                    for s2, _ in slots[i + 1:]:
+                        # อ่านคนปัจจุบันใหม่ทุกครั้ง เพราะเวรในวันนี้อาจถูกสลับไปแล้วในรอบก่อนหน้า
+                        a, b = day[s1], day[s2]
+                        if a == b or self.shift_types[s1]['hours'] != self.shift_types[s2]['hours']:
+                            continue
+                        rank_a_old, rank_a_new = self.get_preference_score(a, s1), self.get_preference_score(a, s2)
+                        rank_b_old, rank_b_new = self.get_preference_score(b, s2), self.get_preference_score(b, s1)
+                        score_delta = (rank_a_new - rank_a_old) + (rank_b_new - rank_b_old)
+                        if score_delta == 0 and rank_a_new == rank_a_old:
+                            continue
+
+                        new_points_a = achieved_points[a] - max(0, 9 - rank_a_old) + max(0, 9 - rank_a_new)
+                        new_points_b = achieved_points[b] - max(0, 9 - rank_b_old) + max(0, 9 - rank_b_new)
+                        trial = dict(percentages)
+                        trial[a] = percentage(new_points_a, shifts_worked[a])
+                        trial[b] = percentage(new_points_b, shifts_worked[b])
+                        trial_variance = self._variance(trial.values()) if len(trial) > 1 else 0
+                        if score_weight * score_delta + variance_weight * (trial_variance - current_variance) >= -1e-9:
+                            continue
+                        dept1, dept2 = self.get_department_from_shift(s1), self.get_department_from_shift(s2)
+                        if leaves_below_min(a, dept1, dept2) or leaves_below_min(b, dept2, dept1):
+                            continue
+                        if (self._breaks_restricted_next_day(a, date, s2, schedule_dict)
+                                or self._breaks_restricted_next_day(b, date, s1, schedule_dict)):
+                            continue
+
+                        # ถอดทั้งสองคนออกชั่วคราว แล้วให้ availability checker เดิมตัดสินทีละคน
+                        day[s1] = day[s2] = 'NO SHIFT'
+                        temp_hours = pharmacist_hours.copy()
+                        temp_hours[a] -= self.shift_types[s1]['hours']
+                        temp_hours[b] -= self.shift_types[s2]['hours']
+                        feasible = bool(self._get_available_pharmacists_optimized(
+                            [a], date, s2, schedule_dict, temp_hours, pharmacist_consecutive_days, feasibility_only=True
+                        ))
+                        if feasible:
+                            day[s2] = a
+                            feasible = bool(self._get_available_pharmacists_optimized(
+                                [b], date, s1, schedule_dict, temp_hours, pharmacist_consecutive_days, feasibility_only=True
+                            ))
+                        if not feasible:
+                            day[s1], day[s2] = a, b
+                            continue
+
+                        day[s1], day[s2] = b, a
+                        achieved_points[a], achieved_points[b] = new_points_a, new_points_b
+                        if dept1 != dept2:
+                            for pharmacist, from_dept, to_dept in ((a, dept1, dept2), (b, dept2, dept1)):
+                                if pharmacist in self.min_shift_requirements:
+                                    dept_counts[(pharmacist, from_dept)] -= 1
+                                    dept_counts[(pharmacist, to_dept)] += 1
+                        percentages, current_variance = trial, trial_variance
+                        swaps_this_pass += 1
+            swaps += swaps_this_pass
+            if not swaps_this_pass:
+                break
+        return swaps
+
+    def _junior_slot_conflict(self, date, shift_type, new_dept, overlapping, schedule_dict):
+        """
+        Junior Constraint ของเวรนี้ในวันนี้ (ขึ้นกับเวร/วัน/ตารางเท่านั้น ไม่ขึ้นกับว่า junior คนไหน)
+        คืน True ถ้าเพิ่ม junior อีกคนลงเวรนี้แล้วเกินโควต้าแผนก หรือชนคู่เวรที่ห้าม junior คู่กัน
+        """
+        junior_conflict = False
+
+        # --- 1. Department Level Check (เช็คโควต้าพื้นฐานของแต่ละแผนกตามเดิม) ---
+        current_juniors_in_dept = 0
+        total_dept_shifts_at_time = 0
+
+        for s_type in self.shift_types:
+            if self.get_department_from_shift(s_type) == new_dept and self.is_shift_available_on_date(s_type, date):
+                if s_type in overlapping:
+                    total_dept_shifts_at_time += 1
+
+        for existing_shift, assigned_pharm in schedule_dict[date].items():
+            if assigned_pharm in self.junior_staff:
+                existing_dept = self.get_department_from_shift(existing_shift)
+                if new_dept == existing_dept:
+                    if existing_shift in overlapping:
+                        current_juniors_in_dept += 1
+
+        max_juniors_allowed = 2 if total_dept_shifts_at_time >= 4 else 1
+
+        if shift_type in ['O400F2-8/1', 'O400F2-8/2', 'O400F2-8/3']:
+            max_juniors_allowed = 2
+
+        if shift_type in ['Care/1', 'Care/2']:
+            max_juniors_allowed = 2
+
+        if current_juniors_in_dept + 1 > max_juniors_allowed:
+            junior_conflict = True
+
+        # --- 2. Specific Pair Check (ห้าม Junior คู่กันในเวรที่กำหนด) ---
+        if not junior_conflict:
+            # คู่ที่ 1: O400F2-6 กับ O400ER-6
+            pair1 = ('O400F2-6', 'O400ER-6')
+            if shift_type in pair1:
+                other_shift = pair1[0] if shift_type == pair1[1] else pair1[1]
+                assigned_pharm = schedule_dict[date].get(other_shift)
+
+                # ถ้าเวรคู่กันถูกจัดไปแล้ว ให้เช็กว่าเป็น Junior หรือไม่
+                if assigned_pharm in self.junior_staff:
+                    junior_conflict = True
+
+            # คู่ที่ 2: I100-6 กับ I400-6
+            pair2 = ('I100-6', 'I400-6')
+            if shift_type in pair2:
+                other_shift = pair2[0] if shift_type == pair2[1] else pair2[1]
+                assigned_pharm = schedule_dict[date].get(other_shift)
+
+                if assigned_pharm in self.junior_staff:
+                    junior_conflict = True
+
+        return junior_conflict
+
+    def _get_available_pharmacists_optimized(self, pharmacists, date, shift_type, schedule_dict, current_hours_dict, consecutive_days_dict, feasibility_only=False, night_yesterday=None):
+        # feasibility_only=True: เช็คแค่ hard constraints แล้วคืน [{'name': ...}] ไม่คำนวณข้อมูลให้คะแนน (ใช้ใน local search)
+        # night_yesterday: set คนเวรดึกเมื่อวานที่ลูปรายวันคำนวณไว้แล้ว (ไม่ส่งมา = สแกนเองจาก schedule_dict)
         available_pharmacists = []
-        pharmacists_on_night_yesterday = set()
+        pharmacists_on_night_yesterday = set() if night_yesterday is None else night_yesterday
+        restricted_after_yesterday = set()  # คนที่เวรเมื่อวานห้ามต่อด้วยเวรนี้ (restricted_next_shifts)
         previous_date = date - timedelta(days=1)
         if previous_date in schedule_dict:
-            pharmacists_on_night_yesterday = {
+            if night_yesterday is None:
+                pharmacists_on_night_yesterday = {
+                    p for s, p in schedule_dict[previous_date].items()
+                    if p in self.pharmacists and self.is_night_shift(s)
+                }
+            restricted_after_yesterday = {
                 p for s, p in schedule_dict[previous_date].items()
-                if p in self.pharmacists and self.is_night_shift(s)
+                if shift_type in self.restricted_next_shifts[s]
             }
 
-        new_start = self.shift_types[shift_type]['start_time']
-        new_end = self.shift_types[shift_type]['end_time']
         new_dept = self.get_department_from_shift(shift_type)
+        date_str = self.get_date_str(date)
+        tallies = None  # สร้างครั้งแรกเมื่อมี candidate ผ่าน hard constraints
+        skill_eligible = self.skill_eligible[shift_type]
+        overlapping = self.overlapping_shifts[shift_type]
+        shift_hours = self.shift_types[shift_type]['hours']
+        # คนที่ถือเวรอื่นที่เวลาทับกับเวรนี้อยู่แล้วในวันนี้ (เทียบกับตาราง overlap ที่คำนวณไว้ครั้งเดียว)
+        busy_overlapping = {
+            p for s, p in schedule_dict[date].items()
+            if s != shift_type and s in overlapping
+        } if date in schedule_dict else set()
+        # เวร C8: นับสัดส่วน mixing expert ของวันนี้ครั้งเดียว แล้วแต่ละ candidate แค่บวกตัวเองเข้าไป
+        mixing_tally = self._mixing_expert_tally(schedule_dict, date) if shift_type.startswith('C8') else None
+        # เวรดึก: คนที่มีเวรดึกในช่วง ±2 วัน สแกนครั้งเดียวต่อการค้นหา
+        is_night = self.is_night_shift(shift_type)
+        nearby_night = set()
+        if is_night:
+            for delta in [-2, -1, 1, 2]:
+                check_date = date + timedelta(days=delta)
+                if check_date in schedule_dict:
+                    nearby_night.update(
+                        p for s, p in schedule_dict[check_date].items() if self.is_night_shift(s)
+                    )
 
+        # ค่าที่ขึ้นกับเวรอย่างเดียว ดึงออกนอกลูปรายคน
+        category = self.shift_categories[shift_type]
+        category_limits = self.category_limits.get(category, {}) if category else {}
+        junior_conflict = None  # คำนวณครั้งแรกที่เจอ junior แล้วใช้ซ้ำกับ junior คนอื่นในการค้นหานี้
+        # ค่าที่ขึ้นกับวันอย่างเดียว คำนวณครั้งเดียวต่อการค้นหา
+        next_date_str = self.get_date_str(date + timedelta(days=1)) if is_night else None
+        time_elapsed_pct = date.day / pd.Timestamp(date).days_in_month
+        is_weekend = date.weekday() >= 5
+        average_monthly_shift_target = self.get_average_monthly_shift_target(date.year, date.month)
+
+        # ลำดับการเช็ค: lookup ใน set/dict ที่ถูกก่อน แล้วค่อยเช็คที่ต้องสแกนตาราง (junior, C8 ratio, streak) ท้ายสุด
+        # skill อยู่ท้ายกลุ่มแรก เพราะ generator ส่งรายชื่อที่กรอง skill มาแล้วแทบทุกครั้ง
         for pharmacist in pharmacists:
-            if date.strftime('%Y-%m-%d') in self.pharmacists[pharmacist]['holidays']: continue
-            if self.has_overlapping_shift_optimized(pharmacist, date, shift_type, schedule_dict): continue
+            if date_str in self.holiday_sets[pharmacist]: continue
             if pharmacist in pharmacists_on_night_yesterday: continue
-            p_skills = [skill.strip().lower() for skill in self.pharmacists[pharmacist]['skills']]
-            s_req_skills = [skill.strip().lower() for skill in self.shift_types[shift_type]['required_skills'] if skill.strip()]
-            if not all(skill in p_skills for skill in s_req_skills): continue
-
-            projected_hours = current_hours_dict[pharmacist] + self.shift_types[shift_type]['hours']
-            if projected_hours > self.pharmacists[pharmacist].get('max_hours', 250): continue
-            if self.has_restricted_sequence_optimized(pharmacist, date, shift_type, schedule_dict): continue
+            if pharmacist in busy_overlapping: continue
 
-            # --- START: Junior Constraint Logic ---
-            is_junior = 'junior' in p_skills
-            if is_junior:
-                junior_conflict = False
-
-                # --- 1. Department Level Check (เช็คโควต้าพื้นฐานของแต่ละแผนกตามเดิม) ---
-                current_juniors_in_dept = 0
-                total_dept_shifts_at_time = 0
-
-                for s_type, s_info in self.shift_types.items():
-                    if self.get_department_from_shift(s_type) == new_dept and self.is_shift_available_on_date(s_type, date):
-                        s_start = s_info['start_time']
-                        s_end = s_info['end_time']
-                        if self.check_time_overlap(new_start, new_end, s_start, s_end):
-                            total_dept_shifts_at_time += 1
-
-                for existing_shift, assigned_pharm in schedule_dict[date].items():
-                    if assigned_pharm in self.pharmacists:
-                        existing_is_junior = 'junior' in [s.strip().lower() for s in self.pharmacists[assigned_pharm]['skills']]
-                        if existing_is_junior:
-                            existing_dept = self.get_department_from_shift(existing_shift)
-                            if new_dept == existing_dept:
-                                existing_start = self.shift_types[existing_shift]['start_time']
-                                existing_end = self.shift_types[existing_shift]['end_time']
-                                if self.check_time_overlap(new_start, new_end, existing_start, existing_end):
-                                    current_juniors_in_dept += 1
-
-                max_juniors_allowed = 2 if total_dept_shifts_at_time >= 4 else 1
-
-                if shift_type in ['O400F2-8/1', 'O400F2-8/2', 'O400F2-8/3']:
-                    max_juniors_allowed = 2
-
-                if shift_type in ['Care/1', 'Care/2']:
-                    max_juniors_allowed = 2
-
-                if current_juniors_in_dept + 1 > max_juniors_allowed:
-                    junior_conflict = True
+            projected_hours = current_hours_dict[pharmacist] + shift_hours
+            if projected_hours > self.max_hours[pharmacist]: continue
+            if pharmacist in restricted_after_yesterday: continue
 
-                # --- 2. Specific Pair Check (ห้าม Junior คู่กันในเวรที่กำหนด) ---
-                if not junior_conflict:
-                    # คู่ที่ 1: O400F2-6 กับ O400ER-6
-                    pair1 = ('O400F2-6', 'O400ER-6')
-                    if shift_type in pair1:
-                        other_shift = pair1[0] if shift_type == pair1[1] else pair1[1]
-                        assigned_pharm = schedule_dict[date].get(other_shift)
-
-                        # ถ้าเวรคู่กันถูกจัดไปแล้ว ให้เช็กว่าเป็น Junior หรือไม่
-                        if assigned_pharm in self.pharmacists:
-                            other_is_junior = 'junior' in [s.strip().lower() for s in self.pharmacists[assigned_pharm]['skills']]
-                            if other_is_junior:
-                                junior_conflict = True
-
-                    # คู่ที่ 2: I100-6 กับ I400-6
-                    pair2 = ('I100-6', 'I400-6')
-                    if shift_type in pair2:
-                        other_shift = pair2[0] if shift_type == pair2[1] else pair2[1]
-                        assigned_pharm = schedule_dict[date].get(other_shift)
-
-                        if assigned_pharm in self.pharmacists:
-                            other_is_junior = 'junior' in [s.strip().lower() for s in self.pharmacists[assigned_pharm]['skills']]
-                            if other_is_junior:
-                                junior_conflict = True
+            limit = category_limits.get(pharmacist)
+            if limit is not None and self.pharmacists[pharmacist]['category_counts'][category] >= limit:
+                continue
+            if pharmacist not in skill_eligible: continue
 
+            # --- START: Junior Constraint Logic ---
+            if pharmacist in self.junior_staff:
+                if junior_conflict is None:
+                    junior_conflict = self._junior_slot_conflict(date, shift_type, new_dept, overlapping, schedule_dict)
                 if junior_conflict:
                     continue
             # --- END: Junior Constraint Logic ---
 
-            category = self._get_shift_category(shift_type)
-            if category:
-                limit = self.shift_limits.get(pharmacist, {}).get(category)
-                if limit is not None:
-                    current_count = self.pharmacists[pharmacist]['category_counts'][category]
-                    if current_count >= limit:
-                        continue
-            if self.is_night_shift(shift_type):
-                if self.has_nearby_night_shift_optimized(pharmacist, date, schedule_dict): continue
-                next_date = date + timedelta(days=1)
-                if pharmacist in self.pre_assignments and next_date.strftime('%Y-%m-%d') in self.pre_assignments[pharmacist]: continue
-            if shift_type.startswith('C8'):
-                if not self.check_mixing_expert_ratio_optimized(schedule_dict, date, shift_type, pharmacist):
+            if is_night:
+                if pharmacist in nearby_night: continue
+                if pharmacist in self.pre_assignments and next_date_str in self.pre_assignments[pharmacist]: continue
+            if mixing_tally is not None:
+                if not self._mixing_expert_ratio_ok(mixing_tally, pharmacist):
                     continue
             current_streak = self.get_dynamic_consecutive_days(pharmacist, date, schedule_dict)
 
             # Hard Constraint: ถ้าบวกเวรนี้เข้าไปแล้วทำงานติดกันเกินเพดาน ให้ตัดชื่อทิ้งทันที
             if current_streak >= self.MAX_CONSECUTIVE_DAYS:
                 continue
+            if feasibility_only:
+                available_pharmacists.append({'name': pharmacist})
+                continue
 
             original_preference = self.get_preference_score(pharmacist, shift_type)
             multiplier = self.preference_multipliers.get(pharmacist, 1.0)
@@ -1569,17 +2060,16 @@ class PharmacistScheduler:
             # --- START: New Pacing Metrics ---
             max_hrs = self.pharmacists[pharmacist].get('max_hours', 250)
             current_hrs = current_hours_dict[pharmacist]
-
-            days_in_month = pd.Timestamp(date).days_in_month
-            time_elapsed_pct = date.day / days_in_month
             hours_used_pct = current_hrs / max_hrs if max_hrs > 0 else 1.0
             # --- END: New Pacing Metrics ---
 
             # --- START: New Soul Mate & Weekend Prep ---
-            is_weekend = date.weekday() >= 5
+            if tallies is None:
+                tallies = self._summarize_schedule_dict(schedule_dict, date)
+            weekend_days_worked_before = tallies['weekend_days'][pharmacist]
             weekend_days_worked = 0
             if is_weekend:
-                weekend_days_worked = self.get_weekend_days_worked(pharmacist, schedule_dict)
+                weekend_days_worked = weekend_days_worked_before
 
             soulmate = self.soul_mates.get(pharmacist)
             soulmate_working_today = False
@@ -1590,10 +2080,13 @@ class PharmacistScheduler:
                 if soulmate in schedule_dict[date].values():
                     soulmate_working_today = True
                 # เช็คว่าวันนี้คู่หูลาหยุด (Holiday) หรือไม่
-                if soulmate in self.pharmacists and date.strftime('%Y-%m-%d') in self.pharmacists[soulmate]['holidays']:
+                if soulmate in self.pharmacists and date_str in self.holiday_sets[soulmate]:
                     mate_on_holiday = True
             # --- END: New Soul Mate & Weekend Prep ---
 
+            department_count = tallies['department'][(pharmacist, new_dept)] if new_dept else 0
+            min_req = self.min_shift_requirements.get(pharmacist, {}).get(new_dept, 0) if new_dept else 0
+
             pharmacist_data = {
                 'name': pharmacist,
                 'preference_score': original_preference * multiplier,
@@ -1612,15 +2105,15 @@ class PharmacistScheduler:
                 'has_soulmate': bool(soulmate),
                 'soulmate_working_today': soulmate_working_today,
                 'mate_on_holiday': mate_on_holiday,
-                'needs_min_shift': self._needs_min_shift(pharmacist, shift_type, schedule_dict),
+                'needs_min_shift': 0 < min_req and department_count < min_req,
                 'no_preference': self.pharmacists[pharmacist].get('no_preference', False),
-                'department_count': self.get_dept_shift_count(pharmacist, new_dept, schedule_dict) if new_dept else 0,
-                'total_shift_count': self.get_total_shift_count_in_schedule_dict(pharmacist, schedule_dict),
-                'has_worked_this_department': (new_dept in self.get_unique_departments_worked(pharmacist, schedule_dict)) if new_dept else True,
-                'average_monthly_shift_target': self.get_average_monthly_shift_target(date.year, date.month),
-                'month_segment_shift_count': self.get_month_segment_shift_count(pharmacist, date, schedule_dict),
-                'total_weekend_days': self.get_total_weekend_days_in_schedule(schedule_dict),
-                'weekend_days_worked_before': self.get_weekend_days_worked_until(pharmacist, schedule_dict),
+                'department_count': department_count,
+                'total_shift_count': tallies['total'][pharmacist],
+                'has_worked_this_department': department_count > 0 if new_dept else True,
+                'average_monthly_shift_target': average_monthly_shift_target,
+                'month_segment_shift_count': tallies['segment_days'][pharmacist],
+                'total_weekend_days': tallies['total_weekend_days'],
+                'weekend_days_worked_before': weekend_days_worked_before,
             }
             available_pharmacists.append(pharmacist_data)
         return available_pharmacists
@@ -1630,7 +2123,7 @@ class PharmacistScheduler:
         คืนค่า list of (pharmacist, department, required, actual)
         """
         violations = []
-        schedule_dict = {date: schedule.loc[date].to_dict() for date in schedule.index}
+        schedule_dict = schedule.to_dict(orient='index')  # {date: {shift_code: pharmacist}} ครั้งเดียว ไม่สร้าง Series ทีละแถว
 
         for pharmacist, dept_reqs in self.min_shift_requirements.items():
             for department, min_count in dept_reqs.items():
@@ -1718,21 +2211,21 @@ class PharmacistScheduler:
         )
 
     def _select_best_pharmacist(self, available_pharmacists, shift_type, date, is_day_before_problem_day):
-        if self.is_night_shift(shift_type) and is_day_before_problem_day:
+        is_night = self.is_night_shift(shift_type)
+        if is_night and is_day_before_problem_day:
             problem_day = date + timedelta(days=1)
-            problem_day_str = problem_day.strftime('%Y-%m-%d')
+            problem_day_str = self.get_date_str(problem_day)
 
-            candidates_off_tomorrow = []
-            for p_data in available_pharmacists:
-                p_name = p_data['name']
-                if problem_day_str in self.pharmacists[p_name]['holidays']:
-                    candidates_off_tomorrow.append(p_data)
+            candidates_off_tomorrow = [
+                p_data for p_data in available_pharmacists
+                if problem_day_str in self.holiday_sets[p_data['name']]
+            ]
 
             if candidates_off_tomorrow:
-                print(f"INFO: Prioritizing night shift on {date.strftime('%Y-%m-%d')} for pharmacists off on problem day {problem_day_str}.")
+                print(f"INFO: Prioritizing night shift on {self.get_date_str(date)} for pharmacists off on problem day {problem_day_str}.")
                 return min(candidates_off_tomorrow, key=lambda x: (x['night_count'], self._calculate_suitability_score(x)))
 
-        if self.is_night_shift(shift_type):
+        if is_night:
             return min(available_pharmacists, key=lambda x: (x['night_count'], self._calculate_suitability_score(x)))
         elif shift_type.startswith('C8'):
             return min(available_pharmacists, key=lambda x: (x['mixing_count'], self._calculate_suitability_score(x)))
@@ -1742,21 +2235,22 @@ class PharmacistScheduler:
             return min(available_pharmacists, key=lambda x: self._calculate_suitability_score(x))
 
     def calculate_preference_penalty(self, pharmacist, schedule):
+        shift_counts = (schedule.to_numpy() == pharmacist).sum(axis=0).tolist()
         penalty = 0
-        for date in schedule.index:
-            for shift_type, assigned_pharm in schedule.loc[date].items():
-                if assigned_pharm == pharmacist:
-                    penalty += self.get_preference_score(pharmacist, shift_type)
+        for shift_type, count in zip(schedule.columns, shift_counts):
+            if count:
+                penalty += self.get_preference_score(pharmacist, shift_type) * count
         return penalty
 
     def get_dynamic_consecutive_days(self, pharmacist, date, schedule_dict):
         """นับจำนวนวันทำงานต่อเนื่อง โดยกวาดดูทั้งอดีตและอนาคตจาก Schedule ปัจจุบัน"""
+        # ชื่อคนไม่มีทางเป็นค่า placeholder ('NO SHIFT' ฯลฯ) จึงเช็ค `in values()` ตรง ๆ ได้ (สแกนใน C)
         streak = 0
 
         # เช็คย้อนหลัง (Backward)
         curr_date = date - timedelta(days=1)
         while curr_date in schedule_dict:
-            worked_backward = any(p == pharmacist for p in schedule_dict[curr_date].values() if p not in ['NO SHIFT', 'UNFILLED', 'UNASSIGNED'])
+            worked_backward = pharmacist in schedule_dict[curr_date].values()
             if worked_backward:
                 streak += 1
                 curr_date -= timedelta(days=1)
@@ -1766,7 +2260,7 @@ class PharmacistScheduler:
         # เช็คเดินหน้า (Forward - จำเป็นเพราะเราจัด Problem Days ก่อน)
         curr_date = date + timedelta(days=1)
         while curr_date in schedule_dict:
-            worked_forward = any(p == pharmacist for p in schedule_dict[curr_date].values() if p not in ['NO SHIFT', 'UNFILLED', 'UNASSIGNED'])
+            worked_forward = pharmacist in schedule_dict[curr_date].values()
             if worked_forward:
                 streak += 1
                 curr_date += timedelta(days=1)
@@ -1783,67 +2277,66 @@ class PharmacistScheduler:
                 weekend_days += 1
         return weekend_days
 
+    def _weighted_schedule_score(self, metrics):
+        """คะแนนรวมถ่วงน้ำหนักของ metrics (ยิ่งน้อยยิ่งดี) ใช้ตัดสินเมื่อจำนวนเวรว่างเท่ากัน"""
+        return sum(weight * metrics.get(key, 0) for key, weight in self.SCHEDULE_SCORE_WEIGHTS.items())
+
     def is_schedule_better(self, current_metrics, best_metrics):
+        # เทียบจำนวนเวรว่างก่อน คำนวณคะแนนถ่วงน้ำหนักเฉพาะเมื่อเสมอกัน
         current_unfilled = current_metrics.get('unfilled_problem_shifts', float('inf'))
         best_unfilled = best_metrics.get('unfilled_problem_shifts', float('inf'))
-        if current_unfilled < best_unfilled: return True
-        if current_unfilled > best_unfilled: return False
-        weights = {
-            'preference_score': 1.0,
-            'preference_variance': 50.0,
-            'hour_imbalance_penalty': 25.0,
-            'night_variance': 800.0,
-            'weekend_off_variance': 1000.0,
-            'weekend_min_off_shortfall': 5000.0,
-            'month_segment_variance': 2500.0,
-        }
-        current_score = sum(weights[k] * current_metrics.get(k, 0) for k in weights)
-        best_score = sum(weights[k] * best_metrics.get(k, 0) for k in weights)
-        return current_score < best_score
-
-    def optimize_schedule(self, year, month, iterations=10, true_random_override=False, enable_run_log=False):
-        self.run_logs = []
-        self.run_config = {
-            "Year": year,
-            "Month": month,
-            "Iterations": iterations,
-            "True Random Override": true_random_override,
-            "Enable Run Log": enable_run_log,
-            "Staff Type": self.staff_type,
-            "Run At": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-
-        self._log_schedule_event(
-            "RUN_START",
-            "Start schedule generation",
-            Year=year,
-            Month=month,
-            Iterations=iterations,
-            TrueRandomOverride=true_random_override,
-            EnableRunLog=enable_run_log
-        )
+        if current_unfilled != best_unfilled:
+            return current_unfilled < best_unfilled
+        return self._weighted_schedule_score(current_metrics) < self._weighted_schedule_score(best_metrics)
 
+    def _is_iteration_better(self, metrics, best_metrics, true_random_override=False):
+        """
+        เกณฑ์เลือกตารางที่ดีกว่า: โหมด True Random ดู (unfilled, hour penalty, hour SD)
+        โหมดปกติใช้ is_schedule_better
+        """
         if true_random_override:
-            print("\n⚠️ TRUE RANDOM OVERRIDE MODE ENABLED")
-            print("ระบบจะสุ่มจัดเวรแบบ constrained + fairness-aware random")
-            print("ยังคงบังคับ: เวรเปิดจริง, ไม่ overwrite PreAssignments, ไม่จัดหลายเวรในวันเดียว, ไม่จัดคนลา, ต้องมี skill ตรง")
-            print("ยังคงคุม Fairness / Hour Balance: สุ่มจากกลุ่มคนที่ชั่วโมงน้อยหรือใกล้เคียงคนชั่วโมงน้อยก่อน")
-            print("iterations ยังใช้ได้: ระบบจะสุ่มหลายรอบและเลือกตารางที่ hour balance ดีกว่า")
+            current_key = (
+                metrics['unfilled_problem_shifts'],
+                metrics.get('hour_imbalance_penalty', float('inf')),
+                metrics.get('hour_diff_for_logging', float('inf'))
+            )
+            best_key = (
+                best_metrics.get('unfilled_problem_shifts', float('inf')),
+                best_metrics.get('hour_imbalance_penalty', float('inf')),
+                best_metrics.get('hour_diff_for_logging', float('inf'))
+            )
+            return current_key < best_key
+        return self.is_schedule_better(metrics, best_metrics)
 
-            best_schedule = None
-            best_unfilled_info = {}
+    def _run_optimize_iterations(self, year, month, iteration_numbers, true_random_override=False, total_iterations=None):
+        """
+        รัน iterations ตามเลขรอบที่กำหนด แล้วคืน (best_schedule, best_unfilled_info, best_metrics)
+        ใช้ทั้งแบบ serial และใน worker process ของ optimize_schedule(workers > 1)
+        """
+        total_iterations = total_iterations or len(iteration_numbers)
+        best_schedule = None
+        best_unfilled_info = {}
+        if true_random_override:
             best_metrics = {
                 'unfilled_problem_shifts': float('inf'),
                 'hour_imbalance_penalty': float('inf'),
                 'hour_diff_for_logging': float('inf')
             }
+        else:
+            best_metrics = {
+                'unfilled_problem_shifts': float('inf'),
+                'hour_imbalance_penalty': float('inf'),
+                'night_variance': float('inf'),
+                'preference_score': float('inf')
+            }
 
-            for i in range(iterations):
-                print(f"\n--- Fair Random Iteration {i + 1}/{iterations} ---")
+        for i in iteration_numbers:
+            if true_random_override:
+                print(f"\n--- Fair Random Iteration {i}/{total_iterations} ---")
                 current_schedule, unfilled_info = self.generate_monthly_schedule_true_random(
                     year=year,
                     month=month,
-                    iteration_num=i + 1
+                    iteration_num=i
                 )
 
                 metrics = self.calculate_schedule_metrics(current_schedule, year, month)
@@ -1861,25 +2354,15 @@ class PharmacistScheduler:
                 self._log_schedule_event(
                     "TRUE_RANDOM_ITERATION_RESULT",
                     "Completed one fairness-aware random iteration",
-                    Iteration=i + 1,
+                    Iteration=i,
                     UnfilledShifts=metrics['unfilled_problem_shifts'],
                     HourSD=round(metrics.get('hour_diff_for_logging', 0), 4),
                     HourPenalty=round(metrics.get('hour_imbalance_penalty', 0), 4)
                 )
 
-                current_key = (
-                    metrics['unfilled_problem_shifts'],
-                    metrics.get('hour_imbalance_penalty', float('inf')),
-                    metrics.get('hour_diff_for_logging', float('inf'))
-                )
-                best_key = (
-                    best_metrics.get('unfilled_problem_shifts', float('inf')),
-                    best_metrics.get('hour_imbalance_penalty', float('inf')),
-                    best_metrics.get('hour_diff_for_logging', float('inf'))
-                )
-
-                if best_schedule is None or current_key < best_key:
-                    best_schedule = current_schedule.copy()
+                if best_schedule is None or self._is_iteration_better(metrics, best_metrics, True):
+                    # current_schedule สร้างใหม่ทุก iteration และไม่ถูกแก้ต่อ จึงเก็บอ้างอิงได้เลยไม่ต้อง copy
+                    best_schedule = current_schedule
                     best_unfilled_info = unfilled_info.copy()
                     best_metrics = metrics.copy()
                     print("*** Found a fairer random schedule! ***")
@@ -1887,40 +2370,18 @@ class PharmacistScheduler:
                     self._log_schedule_event(
                         "TRUE_RANDOM_BEST_UPDATED",
                         "Found a better fairness-aware random schedule",
-                        Iteration=i + 1,
+                        Iteration=i,
                         UnfilledShifts=metrics['unfilled_problem_shifts'],
                         HourSD=round(metrics.get('hour_diff_for_logging', 0), 4),
                         HourPenalty=round(metrics.get('hour_imbalance_penalty', 0), 4)
                     )
+                continue
 
-            self._log_schedule_event(
-                "RUN_COMPLETE",
-                "Completed fairness-aware constrained true random override mode",
-                TotalUnfilled=len(best_unfilled_info.get('problem_days', [])) + len(best_unfilled_info.get('other_days', [])),
-                FinalHourSD=round(best_metrics.get('hour_diff_for_logging', 0), 4),
-                FinalHourPenalty=round(best_metrics.get('hour_imbalance_penalty', 0), 4)
-            )
-
-            return best_schedule, best_unfilled_info
-
-        best_schedule = None
-        best_metrics = {
-            'unfilled_problem_shifts': float('inf'),
-            'hour_imbalance_penalty': float('inf'),
-            'night_variance': float('inf'),
-            'preference_score': float('inf')
-        }
-        best_unfilled_info = {}
-
-        self._pre_check_staffing_levels(year, month)
-        print(f"\nStarting optimization with {iterations} iterations...")
-
-        for i in range(iterations):
-            print(f"\n--- Iteration {i + 1}/{iterations} ---")
+            print(f"\n--- Iteration {i}/{total_iterations} ---")
             current_schedule, unfilled_info = self.generate_monthly_schedule_shuffled(
                 year,
                 month,
-                iteration_num=i + 1
+                iteration_num=i
             )
 
             metrics = self.calculate_schedule_metrics(current_schedule, year, month)
@@ -1939,7 +2400,7 @@ class PharmacistScheduler:
             self._log_schedule_event(
                 "ITERATION_RESULT",
                 "Completed one optimization iteration",
-                Iteration=i + 1,
+                Iteration=i,
                 UnfilledShifts=metrics['unfilled_problem_shifts'],
                 HourSD=round(metrics.get('hour_diff_for_logging', 0), 4),
                 NightVariance=round(metrics.get('night_variance', 0), 4),
@@ -1948,8 +2409,9 @@ class PharmacistScheduler:
                 PreferencePenalty=round(metrics.get('preference_score', 0), 4)
             )
 
-            if best_schedule is None or self.is_schedule_better(metrics, best_metrics):
-                best_schedule = current_schedule.copy()
+            if best_schedule is None or self._is_iteration_better(metrics, best_metrics):
+                # current_schedule สร้างใหม่ทุก iteration และไม่ถูกแก้ต่อ จึงเก็บอ้างอิงได้เลยไม่ต้อง copy
+                best_schedule = current_schedule
                 best_metrics = metrics.copy()
                 best_unfilled_info = unfilled_info.copy()
                 print("*** Found a more balanced schedule! ***")
@@ -1957,7 +2419,7 @@ class PharmacistScheduler:
                 self._log_schedule_event(
                     "BEST_UPDATED",
                     "Found a better schedule",
-                    Iteration=i + 1,
+                    Iteration=i,
                     UnfilledShifts=metrics['unfilled_problem_shifts'],
                     HourSD=round(metrics.get('hour_diff_for_logging', 0), 4),
                     NightVariance=round(metrics.get('night_variance', 0), 4),
@@ -1966,6 +2428,126 @@ class PharmacistScheduler:
                     PreferencePenalty=round(metrics.get('preference_score', 0), 4)
                 )
 
+        return best_schedule, best_unfilled_info, best_metrics
+
+    def _split_iteration_chunks(self, iteration_numbers, workers):
+        """แบ่งเลขรอบเป็นก้อนละเท่า ๆ กัน ก้อนละ worker"""
+        chunk_size = -(-len(iteration_numbers) // workers)
+        return [iteration_numbers[k:k + chunk_size] for k in range(0, len(iteration_numbers), chunk_size)]
+
+    def _run_worker_chunks(self, tasks):
+        """
+        รัน tasks [(worker_fn, *args), ...] พร้อมกันบน ProcessPoolExecutor แบบ 'fork' แล้วคืนผลตามลำดับ tasks
+        scheduler ส่งให้ worker ครั้งเดียวผ่าน initializer
+        คืน None ถ้าเริ่ม pool ไม่ได้ (ไม่มี 'fork' / fork ไม่สำเร็จ) ให้ผู้เรียก fallback เป็น serial;
+        exception ที่เกิดใน worker ส่งต่อตามปกติ ไม่ถูกกลืนเป็น fallback
+        """
+        executor = None
+        try:
+            mp_context = multiprocessing.get_context('fork')
+            executor = ProcessPoolExecutor(
+                max_workers=len(tasks),
+                mp_context=mp_context,
+                initializer=_init_optimize_worker,
+                initargs=(self,),
+            )
+            futures = [executor.submit(fn, *args) for fn, *args in tasks]
+        except (ValueError, OSError, BrokenProcessPool) as exc:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            print(f"⚠️ Parallel run unavailable ({exc}); falling back to serial iterations.")
+            return None
+
+        with executor:
+            for done, _ in enumerate(as_completed(futures), 1):
+                print(f"Parallel progress: {done}/{len(futures)} worker chunks finished")
+            return [future.result() for future in futures]
+
+    def _run_optimize_iterations_parallel(self, year, month, iterations, true_random_override, workers):
+        """
+        แบ่ง iterations เป็นก้อนตามจำนวน workers แล้วรันพร้อมกันด้วย ProcessPoolExecutor
+        ใช้ 'fork' เพื่อให้ worker เห็นคลาสเดียวกับ process หลัก (Streamlit รันสคริปต์เป็น __main__)
+        scheduler ส่งให้ worker ครั้งเดียวผ่าน initializer ไม่ pickle ไปกับทุก task
+        ถ้าสร้าง process pool ไม่ได้ จะกลับไปรันแบบ serial
+        """
+        iteration_numbers = list(range(1, iterations + 1))
+        chunks = self._split_iteration_chunks(iteration_numbers, workers)
+        seeds = [random.getrandbits(32) for _ in chunks]
+
+        results = self._run_worker_chunks([
+            (_run_optimize_chunk, year, month, chunk, true_random_override, iterations, seed)
+            for chunk, seed in zip(chunks, seeds)
+        ])
+        if results is None:
+            return self._run_optimize_iterations(year, month, iteration_numbers, true_random_override)
+
+        best_schedule, best_unfilled_info, best_metrics = None, {}, {}
+        for schedule, unfilled_info, metrics, run_logs in results:
+            self.run_logs.extend(run_logs)
+            if schedule is None:
+                continue
+            if best_schedule is None or self._is_iteration_better(metrics, best_metrics, true_random_override):
+                best_schedule, best_unfilled_info, best_metrics = schedule, unfilled_info, metrics
+        return best_schedule, best_unfilled_info, best_metrics
+
+    def optimize_schedule(self, year, month, iterations=10, true_random_override=False, enable_run_log=False, workers=1):
+        workers = max(1, min(int(workers or 1), iterations))
+        self.run_logs = []
+        self.run_config = {
+            "Year": year,
+            "Month": month,
+            "Iterations": iterations,
+            "Workers": workers,
+            "True Random Override": true_random_override,
+            "Enable Run Log": enable_run_log,
+            "Staff Type": self.staff_type,
+            "Run At": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+        self._log_schedule_event(
+            "RUN_START",
+            "Start schedule generation",
+            Year=year,
+            Month=month,
+            Iterations=iterations,
+            TrueRandomOverride=true_random_override,
+            EnableRunLog=enable_run_log
+        )
+
+        if true_random_override:
+            print("\n⚠️ TRUE RANDOM OVERRIDE MODE ENABLED")
+            print("ระบบจะสุ่มจัดเวรแบบ constrained + fairness-aware random")
+            print("ยังคงบังคับ: เวรเปิดจริง, ไม่ overwrite PreAssignments, ไม่จัดหลายเวรในวันเดียว, ไม่จัดคนลา, ต้องมี skill ตรง")
+            print("ยังคงคุม Fairness / Hour Balance: สุ่มจากกลุ่มคนที่ชั่วโมงน้อยหรือใกล้เคียงคนชั่วโมงน้อยก่อน")
+            print("iterations ยังใช้ได้: ระบบจะสุ่มหลายรอบและเลือกตารางที่ hour balance ดีกว่า")
+        else:
+            self._pre_check_staffing_levels(year, month)
+            print(f"\nStarting optimization with {iterations} iterations...")
+
+        if workers > 1:
+            best_schedule, best_unfilled_info, best_metrics = self._run_optimize_iterations_parallel(
+                year, month, iterations, true_random_override, workers
+            )
+        else:
+            best_schedule, best_unfilled_info, best_metrics = self._run_optimize_iterations(
+                year, month, range(1, iterations + 1), true_random_override
+            )
+        # export อ่านตัวนับเวรจาก self.pharmacists: ตั้งใหม่ให้ตรงกับตารางที่ดีที่สุด
+        # (serial ค้างค่าของ iteration สุดท้าย, parallel ค่าอยู่ใน worker process)
+        if best_schedule is not None:
+            self._recount_shift_counts(best_schedule)
+
+        if true_random_override:
+            self._log_schedule_event(
+                "RUN_COMPLETE",
+                "Completed fairness-aware constrained true random override mode",
+                TotalUnfilled=len(best_unfilled_info.get('problem_days', [])) + len(best_unfilled_info.get('other_days', [])),
+                FinalHourSD=round(best_metrics.get('hour_diff_for_logging', 0), 4),
+                FinalHourPenalty=round(best_metrics.get('hour_imbalance_penalty', 0), 4)
+            )
+
+            return best_schedule, best_unfilled_info
+
         if best_schedule is not None:
             print("\nOptimization complete!\nFinal metrics for the best schedule found:")
             print(
@@ -2011,30 +2593,39 @@ class PharmacistScheduler:
         ws_run_logs = wb.create_sheet("Run Logs") if enable_run_log else None
         header_fill = PatternFill(start_color='FFD3D3D3', end_color='FFD3D3D3', fill_type='solid')
         border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+        # style objects สร้างครั้งเดียว ใช้ซ้ำทุก cell
+        header_alignment = Alignment(wrap_text=True)
+        no_shift_fill = PatternFill(start_color='FFCCCCCC', fill_type='solid')
+        holiday_fill = PatternFill(start_color='FFFFB6C1', fill_type='solid')
+        weekend_fill = PatternFill(start_color='FFFFE4E1', fill_type='solid')
         ws.cell(row=1, column=1, value='Date').fill = header_fill
         for col, shift_type in enumerate(self.shift_types, 2):
             cell = ws.cell(row=1, column=col, value=f"{self.shift_types[shift_type]['description']}\n({self.shift_types[shift_type]['hours']} hrs)")
-            cell.fill, cell.font, cell.alignment = header_fill, Font(bold=True), Alignment(wrap_text=True)
+            cell.fill, cell.font, cell.alignment = header_fill, BOLD_FONT, header_alignment
         # Sort the schedule by date before exporting
         schedule.sort_index(inplace=True)
+        schedule_rows = schedule.to_dict(orient='index')
         for row, date in enumerate(schedule.index, 2):
             ws.cell(row=row, column=1, value=date.strftime('%Y-%m-%d'))
             is_holiday = self.is_holiday(date)
             is_weekend = date.weekday() >= 5
+            day_row = schedule_rows[date]
             for col, shift_type in enumerate(self.shift_types, 2):
-                cell = ws.cell(row=row, column=col, value=schedule.loc[date, shift_type])
+                value = day_row[shift_type]
+                cell = ws.cell(row=row, column=col, value=value)
                 cell.border = border
-                if schedule.loc[date, shift_type] == 'NO SHIFT': cell.fill = PatternFill(start_color='FFCCCCCC', fill_type='solid')
-                elif is_holiday: cell.fill = PatternFill(start_color='FFFFB6C1', fill_type='solid')
-                elif is_weekend: cell.fill = PatternFill(start_color='FFFFE4E1', fill_type='solid')
-                elif schedule.loc[date, shift_type] == 'UNFILLED': cell.fill = PatternFill(start_color='FFFFFF00', fill_type='solid')
+                if value == 'NO SHIFT': cell.fill = no_shift_fill
+                elif is_holiday: cell.fill = holiday_fill
+                elif is_weekend: cell.fill = weekend_fill
+                elif value == 'UNFILLED': cell.fill = UNFILLED_FILL
         ws.column_dimensions['A'].width = 22
         for col in range(2, len(self.shift_types) + 2):
             ws.column_dimensions[get_column_letter(col)].width = 20
         self.create_schedule_summaries(ws, schedule)
-        self.create_daily_summary(ws_daily, schedule)
+        assignments = self._schedule_assignment_index(schedule)
+        self.create_daily_summary(ws_daily, schedule, assignments)
         self.create_preference_score_summary(ws_pref, schedule)
-        self.create_daily_summary_with_codes(ws_daily_codes, schedule)
+        self.create_daily_summary_with_codes(ws_daily_codes, schedule, assignments)
         self.create_negotiation_summary(ws_negotiate, schedule)
 
         self.create_signature_sheet(ws_signature, schedule)
@@ -2046,11 +2637,13 @@ class PharmacistScheduler:
         header_fill = PatternFill(start_color='FFFF0000', end_color='FFFF0000', fill_type='solid')
         border = Border(left=Side(style='thin'), right=Side(style='thin'),
                         top=Side(style='thin'), bottom=Side(style='thin'))
+        header_font = Font(bold=True, color="FFFFFFFF")
+        shortfall_fill = PatternFill(start_color='FFFFF2CC', end_color='FFFFF2CC', fill_type='solid')
 
         for col, h in enumerate(headers, 1):
             cell = ws_min_req.cell(row=1, column=col, value=h)
             cell.fill = header_fill
-            cell.font = Font(bold=True, color="FFFFFFFF")
+            cell.font = header_font
             cell.border = border
 
         if not violations:
@@ -2064,8 +2657,7 @@ class PharmacistScheduler:
                     cell = ws_min_req.cell(row=row, column=col, value=val)
                     cell.border = border
                     if v['shortfall'] > 0:
-                        cell.fill = PatternFill(start_color='FFFFF2CC',
-                                                end_color='FFFFF2CC', fill_type='solid')
+                        cell.fill = shortfall_fill
 
         ws_min_req.column_dimensions['A'].width = 35
         for col in ['B','C','D','E']:
@@ -2073,7 +2665,7 @@ class PharmacistScheduler:
 
 
         if enable_run_log and ws_run_logs is not None:
-            ws_run_logs.cell(row=1, column=1, value="Run Configuration").font = Font(bold=True)
+            ws_run_logs.cell(row=1, column=1, value="Run Configuration").font = BOLD_FONT
 
             config_row = 2
             for key, value in self.run_config.items():
@@ -2082,7 +2674,7 @@ class PharmacistScheduler:
                 config_row += 1
 
             log_start_row = config_row + 2
-            ws_run_logs.cell(row=log_start_row, column=1, value="Run Logs").font = Font(bold=True)
+            ws_run_logs.cell(row=log_start_row, column=1, value="Run Logs").font = BOLD_FONT
 
             if self.run_logs:
                 all_keys = []
@@ -2092,11 +2684,13 @@ class PharmacistScheduler:
                             all_keys.append(key)
 
                 header_row = log_start_row + 1
+                log_header_fill = PatternFill(start_color='FFD3D3D3', end_color='FFD3D3D3', fill_type='solid')
+                log_header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
                 for col_idx, key in enumerate(all_keys, 1):
                     cell = ws_run_logs.cell(row=header_row, column=col_idx, value=key)
-                    cell.font = Font(bold=True)
-                    cell.fill = PatternFill(start_color='FFD3D3D3', end_color='FFD3D3D3', fill_type='solid')
-                    cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+                    cell.font = BOLD_FONT
+                    cell.fill = log_header_fill
+                    cell.alignment = log_header_alignment
 
                 for row_idx, log in enumerate(self.run_logs, header_row + 1):
                     for col_idx, key in enumerate(all_keys, 1):
@@ -2115,35 +2709,26 @@ class PharmacistScheduler:
         header_fill = PatternFill(start_color='FFD3D3D3', end_color='FFD3D3D3', fill_type='solid')
         x_fill = PatternFill(start_color='FFD3D3D3', end_color='FFD3D3D3', fill_type='solid') # สีเทาอ่อนสำหรับช่อง X
         white_fill = PatternFill(start_color='FFFFFFFF', end_color='FFFFFFFF', fill_type='solid') # สีขาวสำหรับช่องว่าง
-
-        # Mapping สีตามกลุ่มเวรให้ตรงกับ Daily Summary 100%
-        shift_colors = {
-            'I100': 'FF00B050',
-            'O100': 'FF00B0F0',
-            'Care': 'FFD40202',
-            'C8': 'FFE6B8AF',
-            'I400': 'FFFF00FF',
-            'O400F1': 'FF0033CC',
-            'O400F2': 'FFC78AF2',
-            'O400ER': 'FFED7D31',
-            'ARI': 'FF7030A0',
-            'Refill': 'FF741b47'
-        }
+        # style ที่ใช้ซ้ำทุก cell สร้างครั้งเดียว
+        center_alignment = Alignment(horizontal='center', vertical='center')
+        label_alignment = Alignment(wrap_text=True, vertical='center', horizontal='left')
 
         # 2. สร้าง Header แถวบนสุด (วันที่)
         ws.cell(row=1, column=1, value='Shift / Date').fill = header_fill
         ws.cell(row=1, column=1).border = border
-        ws.cell(row=1, column=1).font = Font(bold=True)
+        ws.cell(row=1, column=1).font = BOLD_FONT
 
-        sorted_dates = sorted(schedule.index)
+        sorted_dates = schedule.index.sort_values().tolist()
+        schedule_rows = schedule.to_dict(orient='index')  # {date: {shift_code: pharmacist}}
         for col, date in enumerate(sorted_dates, 2):
             cell = ws.cell(row=1, column=col, value=date.strftime('%d/%m'))
             cell.fill = header_fill
             cell.border = border
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.font = Font(bold=True)
+            cell.alignment = center_alignment
+            cell.font = BOLD_FONT
 
         # 3. สร้างข้อมูลแต่ละแถว (เรียงตามรหัสเวร)
+        label_styles = {}  # (row_color, font_color) -> (fill, font)
         for row, shift_type in enumerate(self.shift_types.keys(), 2):
             shift_info = self.shift_types[shift_type]
 
@@ -2154,31 +2739,36 @@ class PharmacistScheduler:
             row_color = 'FFFFFFFF'
             font_color = 'FF000000' # ค่าเริ่มต้นสีดำ
 
-            # เรียง Prefix จากยาวไปสั้น เพื่อให้ระบบเช็ค O400F1, O400F2 ก่อน O400 ธรรมดา
-            for prefix in sorted(shift_colors.keys(), key=len, reverse=True):
+            # สีตามกลุ่มเวรให้ตรงกับ Daily Summary 100%
+            for prefix in SHIFT_PREFIXES_LONGEST_FIRST:
                 if shift_type.startswith(prefix):
-                    row_color = shift_colors[prefix]
+                    row_color = SHIFT_PREFIX_COLORS[prefix]
                     # แผนกที่สีพื้นหลังเข้ม ให้ใช้ตัวหนังสือสีขาว (อิงตาม Daily Summary)
                     if prefix in ['Care', 'O400F1', 'ARI','Refill']:
                         font_color = 'FFFFFFFF'
                     break
 
-            shift_label_fill = PatternFill(start_color=row_color, end_color=row_color, fill_type='solid')
+            # ใช้ fill/font ชุดเดียวกันสำหรับทุกแถวที่สีเหมือนกัน (ไม่สร้าง style object ใหม่ทุกแถว)
+            if (row_color, font_color) not in label_styles:
+                label_styles[(row_color, font_color)] = (
+                    PatternFill(start_color=row_color, end_color=row_color, fill_type='solid'),
+                    Font(color=font_color, bold=True))
+            shift_label_fill, shift_label_font = label_styles[(row_color, font_color)]
 
             # ลงชื่อเวรในคอลัมน์แรก
             cell_first = ws.cell(row=row, column=1, value=shift_desc)
             cell_first.fill = shift_label_fill
             cell_first.border = border
-            cell_first.alignment = Alignment(wrap_text=True, vertical='center', horizontal='left')
-            cell_first.font = Font(color=font_color, bold=True)
+            cell_first.alignment = label_alignment
+            cell_first.font = shift_label_font
 
             # 4. หยอดข้อมูล X หรือเว้นว่าง ในแต่ละวัน
             for col, date in enumerate(sorted_dates, 2):
                 cell = ws.cell(row=row, column=col)
                 cell.border = border
-                cell.alignment = Alignment(horizontal='center', vertical='center')
+                cell.alignment = center_alignment
 
-                status = schedule.loc[date, shift_type]
+                status = schedule_rows[date][shift_type]
 
                 # ถ้าเป็นวันนั้นไม่มีเวร ให้ใส่ X และทำพื้นหลังสีเทา
                 if status == 'NO SHIFT':
@@ -2203,22 +2793,27 @@ class PharmacistScheduler:
         for col, header_text in enumerate(headers, 1):
             cell = ws.cell(row=1, column=col, value=header_text)
             cell.fill, cell.font, cell.border, cell.alignment = header_fill, bold_white_font, border, alignment
+        schedule_rows = schedule.to_dict(orient='index')  # {date: {shift_code: pharmacist}}
         unfilled_shifts = []
-        for date in schedule.index:
-            for shift_type, assigned_pharm in schedule.loc[date].items():
+        for date, row in schedule_rows.items():
+            for shift_type, assigned_pharm in row.items():
                 if assigned_pharm == 'UNFILLED':
                     unfilled_shifts.append((date, shift_type))
         if not unfilled_shifts:
             ws.cell(row=2, column=1, value="No unfilled shifts in the final schedule.")
             return
         current_row = 2
+        day_sets = self._schedule_day_sets(schedule)
         for date, shift_type in unfilled_shifts:
             required_skills = self.shift_types[shift_type].get('required_skills', [])
+            required_skill_set = {skill.strip() for skill in required_skills if skill.strip()}
+            date_str = self.get_date_str(date)
+            assigned_today = set(schedule_rows[date].values())
             all_candidates = []
             for p_name, p_info in self.pharmacists.items():
-                if not all(skill.strip() in p_info['skills'] for skill in required_skills if skill.strip()): continue
-                if len(self.get_pharmacist_shifts(p_name, date, schedule)) > 0: continue
-                is_on_holiday = date.strftime('%Y-%m-%d') in p_info['holidays']
+                if not required_skill_set <= p_info['skills']: continue
+                if p_name in assigned_today: continue
+                is_on_holiday = date_str in p_info['holidays']
                 # --- START FIX: เพิ่มตัวแปรคำนวณ % การใช้ชั่วโมง ---
                 max_hrs = p_info.get('max_hours', 250)
                 current_hrs = self.calculate_total_hours(p_name, schedule)
@@ -2230,7 +2825,7 @@ class PharmacistScheduler:
                 pharmacist_data = {
                     'name': p_name,
                     'preference_score': self.get_preference_score(p_name, shift_type),
-                    'consecutive_days': self.count_consecutive_shifts(p_name, date, schedule),
+                    'consecutive_days': self.count_consecutive_shifts(p_name, date, schedule, day_sets=day_sets),
                     'night_count': p_info.get('night_shift_count', 0),
                     'mixing_count': p_info.get('mixing_shift_count', 0),
                     'current_hours': current_hrs,
@@ -2258,29 +2853,33 @@ class PharmacistScheduler:
 
     def create_schedule_summaries(self, ws, schedule):
         summary_row = len(schedule) + 3
-        ws.cell(row=summary_row, column=1, value="Summary").font = Font(bold=True)
+        ws.cell(row=summary_row, column=1, value="Summary").font = BOLD_FONT
         hours_row = summary_row + 2
-        ws.cell(row=hours_row, column=1, value="Working Hours Summary").font = Font(bold=True)
+        ws.cell(row=hours_row, column=1, value="Working Hours Summary").font = BOLD_FONT
+        # ชั่วโมงรวมทุกคนจากการสแกนตารางรอบเดียว แทน calculate_total_hours ทีละคน
+        total_hours, _ = self._schedule_hours_and_preference(schedule)
         for i, pharmacist in enumerate(self.pharmacists):
-            hours = self.calculate_total_hours(pharmacist, schedule)
+            hours = total_hours[pharmacist]
             ws.cell(row=hours_row + i + 1, column=1, value=pharmacist)
             ws.cell(row=hours_row + i + 1, column=2, value=f"Total Hours: {hours}")
         night_row = hours_row + len(self.pharmacists) + 2
-        ws.cell(row=night_row, column=1, value="Night Shift Summary").font = Font(bold=True)
+        ws.cell(row=night_row, column=1, value="Night Shift Summary").font = BOLD_FONT
         for i, pharmacist in enumerate(self.pharmacists):
             row = night_row + i + 1
             ws.cell(row=row, column=1, value=pharmacist)
             ws.cell(row=row, column=2, value=f"Night Shifts: {self.pharmacists[pharmacist]['night_shift_count']}")
         shift_row = night_row + len(self.pharmacists) + 2
-        ws.cell(row=shift_row, column=1, value="Shift Count Summary").font = Font(bold=True)
+        ws.cell(row=shift_row, column=1, value="Shift Count Summary").font = BOLD_FONT
         shift_types_list = list(self.shift_types.keys())
+        # นับจำนวนเวรต่อคนต่อคอลัมน์ครั้งเดียว แทนการไล่ .loc ทุกวันต่อทุกคน
+        shift_counts = {st: Counter(values) for st, values in schedule.to_dict(orient='list').items()}
         for col_idx, shift_type in enumerate(shift_types_list, 2):
-            ws.cell(row=shift_row, column=col_idx, value=shift_type).font = Font(bold=True)
+            ws.cell(row=shift_row, column=col_idx, value=shift_type).font = BOLD_FONT
         for row_idx, pharmacist in enumerate(self.pharmacists, 1):
             row_num = shift_row + row_idx
             ws.cell(row=row_num, column=1, value=pharmacist)
             for col_idx, shift_type in enumerate(shift_types_list, 2):
-                count = sum(1 for d in schedule.index if schedule.loc[d, shift_type] == pharmacist)
+                count = shift_counts[shift_type][pharmacist]
                 ws.cell(row=row_num, column=col_idx, value=count)
 
     def _setup_daily_summary_styles(self):
@@ -2291,14 +2890,20 @@ class PharmacistScheduler:
             'holiday_empty_fill': PatternFill(fill_type='solid', start_color='FFFFFF00'),
             'off_fill': PatternFill(fill_type='solid', start_color='FFD3D3D3'),
             'border': Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin')),
-            'fills': {p: PatternFill(fill_type='solid', start_color=c) for p, c in [
-                ('I100', 'FF00B050'), ('O100', 'FF00B0F0'), ('Care', 'FFD40202'), ('C8', 'FFE6B8AF'),
-                ('I400', 'FFFF00FF'), ('O400F1', 'FF0033CC'), ('O400F2', 'FFC78AF2'),
-                ('O400ER', 'FFED7D31'), ('ARI', 'FF7030A0'), ('Refill', 'FF741b47')]},
+            'fills': {p: PatternFill(fill_type='solid', start_color=c) for p, c in SHIFT_PREFIX_COLORS.items()},
+            # prefix สีของแต่ละรหัสเวร (prefix ที่ยาวที่สุดที่ตรง) จับคู่ครั้งเดียวแทนการไล่ startswith ทุก cell
+            'shift_prefix': {
+                st: next((p for p in SHIFT_PREFIXES_LONGEST_FIRST if st.startswith(p)), None) for st in self.shift_types
+            },
             'fonts': {
                 'O400F1': Font(bold=True, color="FFFFFFFF"), 'ARI': Font(bold=True, color="FFFFFFFF"),
                 'Refill': Font(bold=True, color="FFFFFFFF"),
-                'default': Font(bold=True), 'header': Font(bold=True)
+                'default': BOLD_FONT, 'header': BOLD_FONT,
+                'code': Font(bold=True, size=9)
+            },
+            'alignments': {
+                'center': Alignment(horizontal="center", vertical="center"),
+                'note': Alignment(horizontal="center", vertical="center", wrap_text=True)
             }
         }
 
@@ -2326,107 +2931,149 @@ class PharmacistScheduler:
         print(f"Successfully created Google Sheet: '{gsheet_name}' (ID: {file.get('id')})")
         return file.get('id')
 
-    def create_daily_summary(self, ws, schedule):
+    def create_daily_summary(self, ws, schedule, assignments=None):
+        self._write_daily_summary(ws, schedule, assignments, self.get_shift_hour_label, off_label='X', cell_font_key=None)
+        ws.column_dimensions['A'].width = 25
+        for col in range(2, len(schedule.index) + 3):
+            ws.column_dimensions[get_column_letter(col)].width = 7
+
+    def _write_daily_summary(self, ws, schedule, assignments, shift_label, off_label, cell_font_key):
+        """
+        โครงร่วมของ Daily Summary ทั้งสองแบบ: หัววันที่, 3 แถวต่อคน (note / เวรที่ 2 / เวรที่ 1), แถว Total Hours และ Unfilled
+        shift_label(shift_code) คืนข้อความในช่องเวร, off_label คือข้อความวันลา
+        cell_font_key คือ key ใน styles['fonts'] ของ font เริ่มต้นช่องเวร (None = ไม่ตั้ง font ถ้าเวรไม่มีสีประจำ)
+        """
         styles = self._setup_daily_summary_styles()
-        ordered_pharmacists = self.get_ordered_employees()
+        if assignments is None:
+            assignments = self._schedule_assignment_index(schedule)
+        # กรองคนที่อยู่ในข้อมูลจริงครั้งเดียวก่อนวนลูป
+        visible_pharmacists = [p for p in self.get_ordered_employees() if p in self.pharmacists]
+        cell_font = styles['fonts'][cell_font_key] if cell_font_key else None
+        # style ที่ใช้ทุก cell ดึงเป็นตัวแปร local ครั้งเดียว ไม่ต้อง lookup dict ซ้ำในลูป
+        border = styles['border']
+        center_alignment = styles['alignments']['center']
+        note_alignment = styles['alignments']['note']
+        fills, fonts = styles['fills'], styles['fonts']
+        # รหัสเวร -> (fill, font) ของเวรที่มีสีประจำ
+        shift_style = {
+            st: (fills[prefix], fonts.get(prefix, fonts['default']))
+            for st, prefix in styles['shift_prefix'].items() if prefix
+        }
+        off_fill, holiday_empty_fill = styles['off_fill'], styles['holiday_empty_fill']
         ws.cell(row=1, column=1, value='Pharmacist').fill = styles['header_fill']
 
-        sorted_dates = sorted(schedule.index)
+        sorted_dates = schedule.index.sort_values().tolist()
+        # lookup ที่ใช้ซ้ำทุก cell สร้างครั้งเดียว
+        hours_by_code = {st: info['hours'] for st, info in self.shift_types.items()}
+        holiday_dates = set(self.holidays['specific_dates'])
+        schedule_rows = schedule.to_dict(orient='index')  # {date: {shift_code: pharmacist}}
+        date_strs = [d.strftime('%Y-%m-%d') for d in sorted_dates]
+        weekend_flags = [d.weekday() >= 5 for d in sorted_dates]
+        holiday_flags = [ds in holiday_dates for ds in date_strs]
+        off_day_flags = [w or h for w, h in zip(weekend_flags, holiday_flags)]
 
         for col, date in enumerate(sorted_dates, 2):
             cell = ws.cell(row=1, column=col, value=date.strftime('%d/%m'))
             cell.fill, cell.font = styles['header_fill'], styles['fonts']['header']
-            if date.weekday() >= 5: cell.fill = styles['weekend_fill']
-            if self.is_holiday(date): cell.fill = styles['holiday_fill']
+            if weekend_flags[col - 2]: cell.fill = styles['weekend_fill']
+            if holiday_flags[col - 2]: cell.fill = styles['holiday_fill']
 
         current_row = 2
-        for pharmacist in ordered_pharmacists:
-            if pharmacist not in self.pharmacists: continue
+        for pharmacist in visible_pharmacists:
             ws.cell(row=current_row, column=1, value="").fill = styles['header_fill']
             ws.cell(row=current_row + 1, column=1, value=pharmacist).fill = styles['header_fill']
             ws.cell(row=current_row + 2, column=1, value="").fill = styles['header_fill']
+            personal_holidays = self.pharmacists[pharmacist]['holidays']
+            notes = self.special_notes.get(pharmacist, {})
 
             for col, date in enumerate(sorted_dates, 2):
                 note_cell, cell1, cell2 = [ws.cell(row=current_row + r, column=col) for r in range(3)]
                 all_cells = [note_cell, cell1, cell2]
+                date_str = date_strs[col - 2]
+                note_text = notes.get(date_str)
                 for cell in all_cells:
-                    cell.border = styles['border']
-                    cell.alignment = Alignment(horizontal="center", vertical="center")
-
-                date_str = date.strftime('%Y-%m-%d')
-                note_text = self.special_notes.get(pharmacist, {}).get(date_str)
-                shifts = self.get_pharmacist_shifts(pharmacist, date, schedule)
-                is_personal_holiday = date_str in self.pharmacists[pharmacist]['holidays']
-                is_public_holiday_or_weekend = self.is_holiday(date) or date.weekday() >= 5
+                    cell.border = border
+                cell1.alignment = cell2.alignment = center_alignment
+                note_cell.alignment = note_alignment if note_text else center_alignment
+                # font ของ cell1/cell2 เขียนครั้งเดียวตอนท้าย (ไม่เขียนทับซ้ำ)
+                cell1_font = cell2_font = cell_font
+                shifts = assignments.get((pharmacist, date), ())
+                is_personal_holiday = date_str in personal_holidays
+                is_public_holiday_or_weekend = off_day_flags[col - 2]
 
                 # --- START OF LOGIC FIX ---
                 # First, handle holiday or shift display
                 if is_personal_holiday:
-                    cell2.value = 'X'
-                    cell1.value = None
+                    cell2.value = off_label
                     for cell in all_cells:
-                        cell.fill = styles['off_fill']
+                        cell.fill = off_fill
                 else:
                     if len(shifts) > 0:
                         shift = shifts[0]
-                        cell2.value = f"{int(self.shift_types[shift]['hours'])}N" if self.is_night_shift(shift) else int(self.shift_types[shift]['hours'])
-                        prefix = next((p for p in styles['fills'] if shift.startswith(p)), None)
-                        if prefix:
-                            fill_color = styles['fills'][prefix]
-                            cell2.fill, cell2.font = fill_color, styles['fonts'].get(prefix, Font(bold=True))
+                        cell2.value = shift_label(shift)
+                        style = shift_style.get(shift)
+                        if style:
+                            fill_color, cell2_font = style
+                            cell2.fill = fill_color
                             if len(shifts) == 1: cell1.fill = fill_color
 
                     if len(shifts) > 1:
                         shift = shifts[1]
-                        cell1.value = f"{int(self.shift_types[shift]['hours'])}N" if self.is_night_shift(shift) else int(self.shift_types[shift]['hours'])
-                        prefix = next((p for p in styles['fills'] if shift.startswith(p)), None)
-                        if prefix: cell1.fill, cell1.font = styles['fills'][prefix], styles['fonts'].get(prefix, Font(bold=True))
+                        cell1.value = shift_label(shift)
+                        style = shift_style.get(shift)
+                        if style:
+                            cell1.fill, cell1_font = style
 
                     if is_public_holiday_or_weekend:
-                        note_cell.fill = styles['holiday_empty_fill']
+                        note_cell.fill = holiday_empty_fill
                         if not shifts:
-                            if not cell1.value: cell1.fill = styles['holiday_empty_fill']
-                            if not cell2.value: cell2.fill = styles['holiday_empty_fill']
+                            if not cell1.value: cell1.fill = holiday_empty_fill
+                            if not cell2.value: cell2.fill = holiday_empty_fill
+
+                if cell1_font is not None: cell1.font = cell1_font
+                if cell2_font is not None: cell2.font = cell2_font
 
                 # Second, ALWAYS apply the note if it exists. This overwrites nothing in note_cell
                 # but ensures it is displayed regardless of holiday/shift status.
                 if note_text:
                     note_cell.value = note_text
-                    note_cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
                 # --- END OF LOGIC FIX ---
 
             current_row += 3
 
-        # ... (rest of the function is unchanged) ...
         total_row, unfilled_row = current_row + 1, current_row + 2
         ws.cell(row=total_row, column=1, value="Total Hours").fill = styles['header_fill']
         ws.cell(row=unfilled_row, column=1, value="Unfilled Shifts").fill = styles['header_fill']
         for col, date in enumerate(sorted_dates, 2):
-            total_hours = sum(self.shift_types[st]['hours'] for st, p in schedule.loc[date].items() if p not in ['NO SHIFT', 'UNFILLED', 'UNASSIGNED'] and st in self.shift_types)
-            unfilled_shifts = [st for st, p in schedule.loc[date].items() if p in ['UNFILLED', 'UNASSIGNED']]
+            # ชั่วโมงรวมและเวรที่ว่างของวันนั้น ได้จากการไล่ row รอบเดียว
+            total_hours = 0
+            unfilled_shifts = []
+            for shift_code, p in schedule_rows[date].items():
+                if p not in PLACEHOLDER_VALUES:
+                    if shift_code in hours_by_code:
+                        total_hours += hours_by_code[shift_code]
+                elif p != 'NO SHIFT':
+                    unfilled_shifts.append(shift_code)
             ws.cell(row=total_row, column=col, value=total_hours).border = styles['border']
             unfilled_cell = ws.cell(row=unfilled_row, column=col)
             unfilled_cell.border = styles['border']
             if unfilled_shifts:
-                unfilled_cell.value, unfilled_cell.fill = "\n".join(unfilled_shifts), PatternFill(start_color='FFFFFF00', fill_type='solid')
+                unfilled_cell.value, unfilled_cell.fill = "\n".join(unfilled_shifts), UNFILLED_FILL
             else:
                 unfilled_cell.value = "0"
-        ws.column_dimensions['A'].width = 25
-        for col in range(2, len(schedule.index) + 3):
-            ws.column_dimensions[get_column_letter(col)].width = 7
 
     def create_preference_score_summary(self, ws, schedule):
         header_fill = PatternFill(start_color='FFD3D3D3', end_color='FFD3D3D3', fill_type='solid')
         border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        bold_font = Font(bold=True)
         headers = ["Pharmacist", "Preference Score (%)", "Total Shifts Worked"]
         for col, header_text in enumerate(headers, 1):
             cell = ws.cell(row=1, column=col, value=header_text)
-            cell.fill, cell.font, cell.border = header_fill, bold_font, border
+            cell.fill, cell.font, cell.border = header_fill, BOLD_FONT, border
         preference_scores = self.calculate_pharmacist_preference_scores(schedule)
         pharmacist_list = sorted(self.pharmacists.keys())
+        shifts_worked = Counter(schedule.to_numpy().ravel().tolist())
         for row, pharmacist in enumerate(pharmacist_list, 2):
-            total_shifts = sum(1 for date in schedule.index for p in schedule.loc[date] if p == pharmacist)
+            total_shifts = shifts_worked.get(pharmacist, 0)
             score = preference_scores.get(pharmacist, 0)
             ws.cell(row=row, column=1, value=pharmacist).border = border
             score_cell = ws.cell(row=row, column=2, value=score)
@@ -2435,91 +3082,8 @@ class PharmacistScheduler:
             ws.cell(row=row, column=3, value=total_shifts).border = border
         ws.column_dimensions['A'].width, ws.column_dimensions['B'].width, ws.column_dimensions['C'].width = 30, 25, 25
 
-    def create_daily_summary_with_codes(self, ws, schedule):
-        styles = self._setup_daily_summary_styles()
-        ordered_pharmacists = self.get_ordered_employees()
-        ws.cell(row=1, column=1, value='Pharmacist').fill = styles['header_fill']
-
-        sorted_dates = sorted(schedule.index)
-
-        for col, date in enumerate(sorted_dates, 2):
-            cell = ws.cell(row=1, column=col, value=date.strftime('%d/%m'))
-            cell.fill, cell.font = styles['header_fill'], styles['fonts']['header']
-            if date.weekday() >= 5: cell.fill = styles['weekend_fill']
-            if self.is_holiday(date): cell.fill = styles['holiday_fill']
-
-        current_row = 2
-        for pharmacist in ordered_pharmacists:
-            if pharmacist not in self.pharmacists: continue
-            ws.cell(row=current_row, column=1, value="").fill = styles['header_fill']
-            ws.cell(row=current_row + 1, column=1, value=pharmacist).fill = styles['header_fill']
-            ws.cell(row=current_row + 2, column=1, value="").fill = styles['header_fill']
-
-            for col, date in enumerate(sorted_dates, 2):
-                note_cell, cell1, cell2 = [ws.cell(row=current_row + r, column=col) for r in range(3)]
-                all_cells = [note_cell, cell1, cell2]
-                for cell in all_cells:
-                    cell.border = styles['border']
-                    cell.alignment = Alignment(horizontal="center", vertical="center")
-                    if cell != note_cell: cell.font = Font(bold=True, size=9)
-
-                date_str = date.strftime('%Y-%m-%d')
-                note_text = self.special_notes.get(pharmacist, {}).get(date_str)
-                shifts = self.get_pharmacist_shifts(pharmacist, date, schedule)
-                is_personal_holiday = date_str in self.pharmacists[pharmacist]['holidays']
-                is_public_holiday_or_weekend = self.is_holiday(date) or date.weekday() >= 5
-
-                # --- START OF LOGIC FIX ---
-                # First, handle holiday or shift display
-                if is_personal_holiday:
-                    cell2.value = 'OFF'
-                    cell1.value = None
-                    for cell in all_cells:
-                        cell.fill = styles['off_fill']
-                else:
-                    if len(shifts) > 0:
-                        shift_code, cell = shifts[0], cell2
-                        cell.value = shift_code
-                        prefix = next((p for p in styles['fills'] if shift_code.startswith(p)), None)
-                        if prefix:
-                            fill_color = styles['fills'][prefix]
-                            cell.fill, cell.font = fill_color, styles['fonts'].get(prefix, styles['fonts']['default'])
-                            if len(shifts) == 1: cell1.fill = fill_color
-
-                    if len(shifts) > 1:
-                        shift_code, cell = shifts[1], cell1
-                        cell.value = shift_code
-                        prefix = next((p for p in styles['fills'] if shift_code.startswith(p)), None)
-                        if prefix: cell.fill, cell.font = styles['fills'][prefix], styles['fonts'].get(prefix, styles['fonts']['default'])
-
-                    if is_public_holiday_or_weekend:
-                        note_cell.fill = styles['holiday_empty_fill']
-                        if not shifts:
-                            if not cell1.value: cell1.fill = styles['holiday_empty_fill']
-                            if not cell2.value: cell2.fill = styles['holiday_empty_fill']
-
-                # Second, ALWAYS apply the note if it exists.
-                if note_text:
-                    note_cell.value = note_text
-                    note_cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                # --- END OF LOGIC FIX ---
-
-            current_row += 3
-
-        # ... (rest of the function is unchanged) ...
-        total_row, unfilled_row = current_row + 1, current_row + 2
-        ws.cell(row=total_row, column=1, value="Total Hours").fill = styles['header_fill']
-        ws.cell(row=unfilled_row, column=1, value="Unfilled Shifts").fill = styles['header_fill']
-        for col, date in enumerate(sorted_dates, 2):
-            total_hours = sum(self.shift_types[st]['hours'] for st, p in schedule.loc[date].items() if p not in ['NO SHIFT', 'UNFILLED', 'UNASSIGNED'] and st in self.shift_types)
-            unfilled_shifts = [st for st, p in schedule.loc[date].items() if p in ['UNFILLED', 'UNASSIGNED']]
-            ws.cell(row=total_row, column=col, value=total_hours).border = styles['border']
-            unfilled_cell = ws.cell(row=unfilled_row, column=col)
-            unfilled_cell.border = styles['border']
-            if unfilled_shifts:
-                unfilled_cell.value, unfilled_cell.fill = "\n".join(unfilled_shifts), PatternFill(start_color='FFFFFF00', fill_type='solid')
-            else:
-                unfilled_cell.value = "0"
+    def create_daily_summary_with_codes(self, ws, schedule, assignments=None):
+        self._write_daily_summary(ws, schedule, assignments, lambda shift_code: shift_code, off_label='OFF', cell_font_key='code')
         ws.column_dimensions['A'].width = 25
         for col in range(2, len(schedule.index) + 2):
             ws.column_dimensions[get_column_letter(col)].width = 15
@@ -2527,16 +3091,19 @@ class PharmacistScheduler:
     def calculate_pharmacist_preference_scores(self, schedule):
         scores = {}
         MAX_POINTS_PER_SHIFT = 8
+        # นับคนต่อคอลัมน์เวรครั้งเดียว แล้วคูณแต้มของ (คน, เวร) ด้วยจำนวนครั้ง แทนการเรียก get_preference_score ทุก cell
+        achieved_points = {p: 0 for p in self.pharmacists}
+        shifts_worked = {p: 0 for p in self.pharmacists}
+        values = schedule.to_numpy()
+        for col, shift_type in enumerate(schedule.columns):
+            for assigned_pharm, count in Counter(values[:, col].tolist()).items():
+                if assigned_pharm in shifts_worked:
+                    shifts_worked[assigned_pharm] += count
+                    rank = self.get_preference_score(assigned_pharm, shift_type)
+                    achieved_points[assigned_pharm] += max(0, 9 - rank) * count
         for pharmacist in self.pharmacists:
-            total_achieved_points = 0
-            total_shifts_worked = 0
-            for date in schedule.index:
-                for shift_type, assigned_pharm in schedule.loc[date].items():
-                    if assigned_pharm == pharmacist:
-                        total_shifts_worked += 1
-                        rank = self.get_preference_score(pharmacist, shift_type)
-                        points = max(0, 9 - rank)
-                        total_achieved_points += points
+            total_achieved_points = achieved_points[pharmacist]
+            total_shifts_worked = shifts_worked[pharmacist]
             if total_shifts_worked == 0:
                 scores[pharmacist] = 0
             else:
@@ -2558,10 +3125,10 @@ class PharmacistScheduler:
         It does not modify the original _pre_check_staffing_levels function.
         """
         print("\nRunning pre-check for staffing levels for specific dates...")
+        on_leave_counts = self._count_staff_on_leave()
         all_ok = True
         for date in dates_to_schedule:
-            available_pharmacists_count = sum(1 for p_name, p_info in self.pharmacists.items()
-                                              if date.strftime('%Y-%m-%d') not in p_info['holidays'])
+            available_pharmacists_count = len(self.pharmacists) - on_leave_counts[self.get_date_str(date)]
             required_shifts_base = sum(1 for st in self.shift_types
                                        if self.is_shift_available_on_date(st, date))
             total_required_shifts_with_buffer = required_shifts_base + 3
@@ -2582,15 +3149,15 @@ class PharmacistScheduler:
         """
         New variance calculation for a specific set of dates present in a schedule.
         """
-        weekend_off_counts = {p: 0 for p in self.pharmacists}
-        for date in schedule.index:
-            if date.weekday() >= 5: # 5 is Saturday, 6 is Sunday
-                working_on_weekend = {schedule.loc[date, shift] for shift in schedule.columns if schedule.loc[date, shift] not in ['NO SHIFT', 'UNFILLED', 'UNASSIGNED']}
-                for p_name in self.pharmacists:
-                    if p_name not in working_on_weekend:
-                        weekend_off_counts[p_name] += 1
+        # แถวเสาร์-อาทิตย์จาก ndarray ครั้งเดียว แล้วนับวันที่แต่ละคนทำงาน (set ต่อแถวกันนับซ้ำ) เหมือน calculate_weekend_off_variance
+        weekend_mask = np.fromiter((d.weekday() >= 5 for d in schedule.index), dtype=bool, count=len(schedule.index))  # 5 is Saturday, 6 is Sunday
+        weekend_sets = [set(row) for row in schedule.to_numpy()[weekend_mask].tolist()]
+        weekend_worked = Counter()
+        for workers_on_day in weekend_sets:
+            weekend_worked.update(workers_on_day)
+        weekend_off_counts = {p: len(weekend_sets) - weekend_worked[p] for p in self.pharmacists}
         if len(weekend_off_counts) > 1:
-            return np.var(list(weekend_off_counts.values()))
+            return self._variance(weekend_off_counts.values())
         return 0
 
     def calculate_metrics_for_schedule(self, schedule):
@@ -2598,28 +3165,29 @@ class PharmacistScheduler:
         New metrics calculation function that works directly with a schedule DataFrame.
         This avoids the need to pass year and month.
         """
-        hours = {p: self.calculate_total_hours(p, schedule) for p in self.pharmacists}
+        # สแกนตารางครั้งเดียวแล้วให้ทุก metric ใช้ผลร่วมกัน แทนการไล่ทั้งตารางทีละคนทีละ metric
+        hours, preference_penalties = self._schedule_hours_and_preference(schedule)
+        day_sets = self._schedule_day_sets(schedule)
         night_counts = {p: self.pharmacists[p]['night_shift_count'] for p in self.pharmacists}
         weekend_off_var = self.calculate_weekend_off_variance_for_dates(schedule)
-        hour_penalty = self._get_hour_imbalance_penalty(hours)
+        # stdev ของชั่วโมงคำนวณครั้งเดียว ใช้ทั้ง penalty และค่าที่ log
+        hour_stdev = stdev(hours.values()) if len(hours) > 1 else 0
+        hour_penalty = self._get_hour_imbalance_penalty(hours, hour_stdev)
 
         pref_percentages = self.calculate_pharmacist_preference_scores(schedule)
-        pref_variance = np.var(list(pref_percentages.values())) if len(pref_percentages) > 1 else 0
+        pref_variance = self._variance(pref_percentages.values()) if len(pref_percentages) > 1 else 0
 
-        weekend_min_off_violations = self.calculate_weekend_min_off_violations(schedule)
+        weekend_min_off_violations = self.calculate_weekend_min_off_violations(schedule, day_sets)
         metrics = {
             'hour_imbalance_penalty': hour_penalty,
-            'night_variance': np.var(list(night_counts.values())) if night_counts else 0,
-            'preference_score': sum(self.calculate_preference_penalty(p, schedule) for p in self.pharmacists),
+            'night_variance': self._variance(night_counts.values()) if night_counts else 0,
+            'preference_score': sum(preference_penalties.values()),
             'preference_variance': pref_variance,
             'weekend_off_variance': weekend_off_var,
             'weekend_min_off_shortfall': sum(weekend_min_off_violations.values()),
-            'month_segment_variance': self.calculate_month_segment_variance(schedule),
+            'month_segment_variance': self.calculate_month_segment_variance(schedule, day_sets),
         }
-        if len(hours) > 1 and len(hours.values()) > 1:
-            metrics['hour_diff_for_logging'] = stdev(hours.values())
-        else:
-            metrics['hour_diff_for_logging'] = 0
+        metrics['hour_diff_for_logging'] = hour_stdev
         return metrics
 
     def generate_schedule_for_dates(self, dates_to_schedule, iteration_num=1):
@@ -2629,6 +3197,7 @@ class PharmacistScheduler:
         schedule_dict = {date: {shift: 'NO SHIFT' for shift in self.shift_types} for date in dates_to_schedule}
         pharmacist_hours = {p: 0 for p in self.pharmacists}
         pharmacist_consecutive_days = {p: 0 for p in self.pharmacists}
+        streak_nonzero = set()  # คนที่ตัวนับวันติดต่อกันไม่เป็น 0 อยู่ (มีแค่คนเหล่านี้ที่ต้อง reset)
 
         shuffled_shifts = list(self.shift_types.keys())
         random.shuffle(shuffled_shifts)
@@ -2638,14 +3207,17 @@ class PharmacistScheduler:
         for pharmacist in self.pharmacists:
             self.pharmacists[pharmacist]['night_shift_count'] = 0
             self.pharmacists[pharmacist]['mixing_shift_count'] = 0
+            self.pharmacists[pharmacist]['care_shift_count'] = 0
             self.pharmacists[pharmacist]['category_counts'] = {'Mixing': 0, 'Night': 0}
 
+        # pre_assignments ใช้ key 'YYYY-MM-DD' อยู่แล้ว จึงจับคู่กับวันที่ในรายการผ่าน dict (วันแรกที่ตรงชนะ) ไม่ต้อง parse/ไล่ทั้งรายการ
+        dates_by_str = {}
+        for dt in dates_to_schedule:
+            dates_by_str.setdefault(self.get_date_str(dt), dt)
         for pharmacist, assignments in self.pre_assignments.items():
             if pharmacist not in self.pharmacists: continue
             for date_str, shift_types in assignments.items():
-                date = pd.to_datetime(date_str).to_pydatetime().date()
-                # Find the matching datetime object in the list
-                matching_date = next((dt for dt in dates_to_schedule if dt.date() == date), None)
+                matching_date = dates_by_str.get(date_str)
                 if matching_date is None: continue
                 for shift_type in shift_types:
                     if shift_type in self.shift_types:
@@ -2653,32 +3225,36 @@ class PharmacistScheduler:
                         self._update_shift_counts(pharmacist, shift_type)
                         pharmacist_hours[pharmacist] += self.shift_types[shift_type]['hours']
 
-        all_dates = sorted(list(dates_to_schedule))
-        problem_dates_sorted = sorted([d for d in all_dates if d in self.problem_days])
-        other_dates_sorted = sorted([d for d in all_dates if d not in self.problem_days])
-        processing_order_dates = problem_dates_sorted + other_dates_sorted
+        processing_order_dates = self._get_processing_order_dates(dates_to_schedule)
         unfilled_info = {'problem_days': [], 'other_days': []}
 
-        night_shifts_ordered = [s for s in shuffled_shifts if self.is_night_shift(s)]
-        mixing_shifts_ordered = [s for s in shuffled_shifts if s.startswith('C8') and not self.is_night_shift(s)]
-        care_shifts_ordered = [s for s in shuffled_shifts if s.startswith('Care') and not self.is_night_shift(s) and not s.startswith('C8')]
-        other_shifts_ordered = [s for s in shuffled_shifts if not self.is_night_shift(s) and not s.startswith('C8') and not s.startswith('Care')]
-        standard_shift_order = night_shifts_ordered + mixing_shifts_ordered + care_shifts_ordered + other_shifts_ordered
-        problem_day_shift_order = mixing_shifts_ordered + care_shifts_ordered + night_shifts_ordered + other_shifts_ordered
+        standard_shift_order, problem_day_shift_order = self._shift_processing_orders(shuffled_shifts)
+        # candidate ต่อเวร: เฉพาะคนที่ skill ตรง ตามลำดับสุ่มของรอบนี้ (ตัดคนที่ไม่มีทางผ่านออกก่อนเข้า filter)
+        skill_ordered_pharmacists = {
+            shift_type: [p for p in shuffled_pharmacists if p in self.skill_eligible[shift_type]]
+            for shift_type in self.shift_types
+        }
 
         for date in tqdm(processing_order_dates, desc=f"Building Schedule (Iteration {iteration_num})", leave=False):
             previous_date = date - timedelta(days=1)
+            night_yesterday = set()  # คนที่อยู่เวรดึกเมื่อวาน: สแกนครั้งเดียวต่อวัน ใช้ร่วมทุกเวรของวันนี้
             # We can only check consecutive days if the previous day was also in our scheduling set
             if previous_date in schedule_dict:
-                pharmacists_working_yesterday = {p for p in schedule_dict[previous_date].values() if p in self.pharmacists}
-                for p_name in self.pharmacists:
-                    if p_name in pharmacists_working_yesterday:
-                        pharmacist_consecutive_days[p_name] += 1
-                    else:
-                        pharmacist_consecutive_days[p_name] = 0
+                pharmacists_working_yesterday = set()
+                for prev_shift, p in schedule_dict[previous_date].items():
+                    if p in self.pharmacists:
+                        pharmacists_working_yesterday.add(p)
+                        if self.is_night_shift(prev_shift):
+                            night_yesterday.add(p)
+                for p_name in pharmacists_working_yesterday:
+                    pharmacist_consecutive_days[p_name] += 1
+                for p_name in streak_nonzero - pharmacists_working_yesterday:
+                    pharmacist_consecutive_days[p_name] = 0
+                streak_nonzero = pharmacists_working_yesterday
             else: # Reset if previous day wasn't scheduled
-                 for p_name in self.pharmacists:
+                for p_name in streak_nonzero:
                     pharmacist_consecutive_days[p_name] = 0
+                streak_nonzero = set()
 
             is_day_before_problem_day = (date + timedelta(days=1)) in self.problem_days
             shifts_to_process = problem_day_shift_order if date in self.problem_days else standard_shift_order
@@ -2686,7 +3262,7 @@ class PharmacistScheduler:
             for shift_type in shifts_to_process:
                 if schedule_dict[date][shift_type] != 'NO SHIFT' or not self.is_shift_available_on_date(shift_type, date):
                     continue
-                available = self._get_available_pharmacists_optimized(shuffled_pharmacists, date, shift_type, schedule_dict, pharmacist_hours, pharmacist_consecutive_days)
+                available = self._get_available_pharmacists_optimized(skill_ordered_pharmacists[shift_type], date, shift_type, schedule_dict, pharmacist_hours, pharmacist_consecutive_days, night_yesterday=night_yesterday)
                 if available:
                     chosen = self._select_best_pharmacist(available, shift_type, date, is_day_before_problem_day)
                     pharmacist_to_assign = chosen['name']
@@ -2700,26 +3276,55 @@ class PharmacistScheduler:
                     else:
                         unfilled_info['other_days'].append((date, shift_type))
 
-        final_schedule = pd.DataFrame.from_dict(schedule_dict, orient='index')
-        final_schedule.fillna('NO SHIFT', inplace=True)
+        final_schedule = self._schedule_dict_to_frame(schedule_dict)
         return final_schedule, unfilled_info
 
-    def optimize_schedule_for_dates(self, dates_to_schedule, iterations=10):
+    def optimize_schedule_for_dates(self, dates_to_schedule, iterations=10, workers=1):
         """
         New optimizer for scheduling a specific list of dates.
+        workers > 1 แบ่ง iterations ไปรันใน process แยกเหมือน optimize_schedule
         """
-        best_schedule = None
-        best_metrics = {'unfilled_problem_shifts': float('inf'), 'preference_score': float('inf')}
-        best_unfilled_info = {}
+        workers = max(1, min(int(workers or 1), iterations))
 
         # Use the new pre-check function
         self._pre_check_staffing_for_dates(dates_to_schedule)
 
         print(f"\nStarting optimization for {len(dates_to_schedule)} specific dates with {iterations} iterations...")
 
-        for i in range(iterations):
-            print(f"\n--- Iteration {i+1}/{iterations} ---")
-            current_schedule, unfilled_info = self.generate_schedule_for_dates(dates_to_schedule, iteration_num=i+1)
+        iteration_numbers = list(range(1, iterations + 1))
+        if workers > 1:
+            best_schedule, best_unfilled_info, best_metrics = self._run_optimize_iterations_for_dates_parallel(
+                dates_to_schedule, iteration_numbers, workers
+            )
+        else:
+            best_schedule, best_unfilled_info, best_metrics = self._run_optimize_iterations_for_dates(
+                dates_to_schedule, iteration_numbers
+            )
+
+        if best_schedule is not None:
+            self._recount_shift_counts(best_schedule)
+            print("\nOptimization complete!\nFinal metrics for the best schedule found:")
+            print(f"Unfilled Shifts: {best_metrics.get('unfilled_problem_shifts', 0)} | "
+                  f"Hour SD: {best_metrics.get('hour_diff_for_logging', 0):.2f} | "
+                  f"Night Var: {best_metrics.get('night_variance', 0):.2f} | "
+                  f"Weekend Shortfall: {best_metrics.get('weekend_min_off_shortfall', 0)} | "
+                  f"Month Segment Var: {best_metrics.get('month_segment_variance', 0):.2f} | "
+                  f"Pref Penalty: {best_metrics.get('preference_score', 0):.1f}")
+        else:
+            print("\nOptimization failed to find any valid schedule.")
+
+        return best_schedule, best_unfilled_info
+
+    def _run_optimize_iterations_for_dates(self, dates_to_schedule, iteration_numbers, total_iterations=None):
+        """รัน iterations ของ optimize_schedule_for_dates ตามเลขรอบ แล้วคืน (best_schedule, best_unfilled_info, best_metrics)"""
+        total_iterations = total_iterations or len(iteration_numbers)
+        best_schedule = None
+        best_metrics = {'unfilled_problem_shifts': float('inf'), 'preference_score': float('inf')}
+        best_unfilled_info = {}
+
+        for i in iteration_numbers:
+            print(f"\n--- Iteration {i}/{total_iterations} ---")
+            current_schedule, unfilled_info = self.generate_schedule_for_dates(dates_to_schedule, iteration_num=i)
 
             # Use the new metrics calculation function
             metrics = self.calculate_metrics_for_schedule(current_schedule)
@@ -2734,23 +3339,32 @@ class PharmacistScheduler:
                   f"Pref Penalty: {metrics.get('preference_score', 0):.1f}")
 
             if best_schedule is None or self.is_schedule_better(metrics, best_metrics):
-                best_schedule = current_schedule.copy()
+                # current_schedule สร้างใหม่ทุก iteration และไม่ถูกแก้ต่อ จึงเก็บอ้างอิงได้เลยไม่ต้อง copy
+                best_schedule = current_schedule
                 best_metrics = metrics.copy()
                 best_unfilled_info = unfilled_info.copy()
                 print("*** Found a more balanced schedule! ***")
 
-        if best_schedule is not None:
-            print("\nOptimization complete!\nFinal metrics for the best schedule found:")
-            print(f"Unfilled Shifts: {best_metrics.get('unfilled_problem_shifts', 0)} | "
-                  f"Hour SD: {best_metrics.get('hour_diff_for_logging', 0):.2f} | "
-                  f"Night Var: {best_metrics.get('night_variance', 0):.2f} | "
-                  f"Weekend Shortfall: {best_metrics.get('weekend_min_off_shortfall', 0)} | "
-                  f"Month Segment Var: {best_metrics.get('month_segment_variance', 0):.2f} | "
-                  f"Pref Penalty: {best_metrics.get('preference_score', 0):.1f}")
-        else:
-            print("\nOptimization failed to find any valid schedule.")
-
-        return best_schedule, best_unfilled_info
+        return best_schedule, best_unfilled_info, best_metrics
+
+    def _run_optimize_iterations_for_dates_parallel(self, dates_to_schedule, iteration_numbers, workers):
+        """แบ่ง iterations ของ optimize_schedule_for_dates ไปรันใน worker process แล้วเลือกผลที่ดีที่สุดด้วย is_schedule_better"""
+        chunks = self._split_iteration_chunks(iteration_numbers, workers)
+        seeds = [random.getrandbits(32) for _ in chunks]
+        results = self._run_worker_chunks([
+            (_run_optimize_dates_chunk, dates_to_schedule, chunk, len(iteration_numbers), seed)
+            for chunk, seed in zip(chunks, seeds)
+        ])
+        if results is None:
+            return self._run_optimize_iterations_for_dates(dates_to_schedule, iteration_numbers)
+
+        best_schedule, best_unfilled_info, best_metrics = None, {}, {}
+        for schedule, unfilled_info, metrics in results:
+            if schedule is None:
+                continue
+            if best_schedule is None or self.is_schedule_better(metrics, best_metrics):
+                best_schedule, best_unfilled_info, best_metrics = schedule, unfilled_info, metrics
+        return best_schedule, best_unfilled_info, best_metrics
 
 # --- Main execution block ---
 
@@ -2759,6 +3373,8 @@ class PharmacistScheduler:
 # Streamlit UI
 # ==============================================================================
 
+import copy
+import hashlib
 import os
 import tempfile
 from datetime import datetime
@@ -2869,53 +3485,43 @@ st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 @st.cache_data(show_spinner=False)
 def read_excel_sheet_names(file_bytes: bytes):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-        tmp.write(file_bytes)
-        tmp_path = tmp.name
-    try:
-        xls = pd.ExcelFile(tmp_path)
+    # อ่านจาก memory ตรง ๆ ไม่ต้องเขียน temp file ทุก rerun
+    with pd.ExcelFile(io.BytesIO(file_bytes)) as xls:
         return xls.sheet_names
-    finally:
-        try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
 
 
-def save_uploaded_file(uploaded_file):
-    suffix = ".xlsx"
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(uploaded_file.getvalue())
-        return tmp.name
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_scheduler_template(file_bytes: bytes, employee_sheet_name: str, staff_type: str):
+    # อ่าน/parse workbook ครั้งเดียวต่อ (ไฟล์, ชีตพนักงาน, ประเภท) ข้าม rerun
+    # ตัวต้นแบบนี้ไม่ถูกรันตรง ๆ: ทุกครั้งที่กด Run ให้ deepcopy ไปใช้ เพราะ optimize_schedule แก้ state ภายใน
+    return PharmacistScheduler(
+        io.BytesIO(file_bytes),
+        employee_sheet_name=employee_sheet_name,
+        staff_type=staff_type,
+    )
 
 
 def make_hour_summary(scheduler: PharmacistScheduler, schedule: pd.DataFrame) -> pd.DataFrame:
-    rows = []
-    for name in scheduler.get_ordered_employees():
-        if name not in scheduler.pharmacists:
-            continue
-        total_hours = scheduler.calculate_total_hours(name, schedule)
-        total_shifts = int((schedule == name).sum().sum())
-        night_shifts = int(sum(
-            1
-            for date in schedule.index
-            for shift, assigned in schedule.loc[date].items()
-            if assigned == name and scheduler.is_night_shift(shift)
-        ))
-        weekend_days = int(sum(
-            1
-            for date in schedule.index
-            if date.weekday() >= 5 and name in schedule.loc[date].values
-        ))
-        rows.append({
-            "Name": name,
-            "Total Hours": total_hours,
-            "Total Shifts": total_shifts,
-            "Night Shifts": night_shifts,
-            "Weekend Days Worked": weekend_days,
-            "Max Hours": scheduler.pharmacists[name].get("max_hours", 250),
-        })
-    return pd.DataFrame(rows)
+    names = [n for n in scheduler.get_ordered_employees() if n in scheduler.pharmacists]
+
+    # long-form (Date, Shift, Assigned) หนึ่งครั้ง แล้ว aggregate ด้วย groupby
+    long_df = schedule.rename_axis(index="Date", columns="Shift").stack().rename("Assigned").reset_index()
+    long_df = long_df[long_df["Assigned"].isin(names)]
+    hours_by_code = {st: info["hours"] for st, info in scheduler.shift_types.items()}
+    long_df["Hours"] = long_df["Shift"].map(hours_by_code).fillna(0)
+    long_df["Night"] = long_df["Shift"].map(scheduler.is_night_shift)
+    long_df["Weekend"] = pd.to_datetime(long_df["Date"]).dt.weekday >= 5
+
+    grouped = long_df.groupby("Assigned")
+    summary = pd.DataFrame({
+        "Total Hours": grouped["Hours"].sum(),
+        "Total Shifts": grouped.size(),
+        "Night Shifts": grouped["Night"].sum(),
+        "Weekend Days Worked": long_df[long_df["Weekend"]].groupby("Assigned")["Date"].nunique(),
+    }).reindex(names).fillna(0)
+    summary = summary.astype({"Total Shifts": int, "Night Shifts": int, "Weekend Days Worked": int})
+    summary["Max Hours"] = [scheduler.pharmacists[name].get("max_hours", 250) for name in names]
+    return summary.rename_axis("Name").reset_index()
 
 
 def make_unfilled_df(unfilled_info) -> pd.DataFrame:
@@ -2931,17 +3537,15 @@ def make_unfilled_df(unfilled_info) -> pd.DataFrame:
 
 
 def make_daily_long_df(schedule: pd.DataFrame) -> pd.DataFrame:
-    rows = []
-    for date in schedule.index:
-        for shift, assigned in schedule.loc[date].items():
-            if assigned not in ["NO SHIFT", "UNFILLED", "UNASSIGNED"]:
-                rows.append({
-                    "Date": pd.to_datetime(date).strftime("%Y-%m-%d"),
-                    "Day": pd.to_datetime(date).strftime("%a"),
-                    "Shift": shift,
-                    "Assigned": assigned,
-                })
-    return pd.DataFrame(rows)
+    long_df = schedule.rename_axis(index="Date", columns="Shift").stack().rename("Assigned").reset_index()
+    long_df = long_df[~long_df["Assigned"].isin(["NO SHIFT", "UNFILLED", "UNASSIGNED"])]
+    dates = pd.to_datetime(long_df["Date"])
+    return pd.DataFrame({
+        "Date": dates.dt.strftime("%Y-%m-%d"),
+        "Day": dates.dt.strftime("%a"),
+        "Shift": long_df["Shift"],
+        "Assigned": long_df["Assigned"],
+    }).reset_index(drop=True)
 
 
 def render_metric_card(label: str, value: str):
@@ -2956,6 +3560,38 @@ def render_metric_card(label: str, value: str):
     )
 
 
+def schedule_fingerprint(schedule: pd.DataFrame, unfilled_info, enable_run_log) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(pd.util.hash_pandas_object(schedule.sort_index(), index=True).to_numpy().tobytes())
+    h.update(repr(sorted((k, sorted(map(str, v))) for k, v in unfilled_info.items())).encode("utf-8"))
+    h.update(repr(enable_run_log).encode("utf-8"))
+    return h.hexdigest()
+
+
+def get_export_bytes_cached(scheduler, schedule, unfilled_info, enable_run_log):
+    # rerun ของ Streamlit (เปลี่ยน tab / กดปุ่ม) ไม่ต้อง export Excel ใหม่ถ้าตารางเดิม
+    fingerprint = schedule_fingerprint(schedule, unfilled_info, enable_run_log)
+    cached = st.session_state.get("excel_export")
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    excel_bytes = export_schedule_to_bytes(scheduler, schedule, unfilled_info, enable_run_log)
+    st.session_state["excel_export"] = (fingerprint, excel_bytes)
+    return excel_bytes
+
+
+def get_dashboard_frames(scheduler, schedule, unfilled_info):
+    # ตารางสรุปบน dashboard คำนวณครั้งเดียวต่อการรัน (ล้างเมื่อกด Run ใหม่) ไม่ต้องทำซ้ำทุก rerun
+    cached = st.session_state.get("dashboard_frames")
+    if cached is None:
+        cached = (
+            make_hour_summary(scheduler, schedule),
+            make_unfilled_df(unfilled_info),
+            make_daily_long_df(schedule),
+        )
+        st.session_state["dashboard_frames"] = cached
+    return cached
+
+
 def export_schedule_to_bytes(scheduler, schedule, unfilled_info, enable_run_log):
     with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
         output_path = tmp.name
@@ -3020,6 +3656,14 @@ with st.sidebar:
     year = st.number_input("Year", min_value=2000, max_value=2100, value=max(current_year, 2026), step=1)
     month = st.number_input("Month", min_value=1, max_value=12, value=6, step=1)
     iterations = st.number_input("Iterations", min_value=1, max_value=500, value=20, step=1)
+    workers = st.number_input(
+        "Parallel workers",
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=1,
+        step=1,
+        help="แบ่ง iterations ไปรันพร้อมกันหลาย process (ค่าเริ่มต้น 1 = รันทีละรอบแบบเดิม, เพิ่มได้สูงสุดเท่าจำนวน CPU cores)",
+    )
 
     st.divider()
     true_random_override = st.toggle(
@@ -3045,15 +3689,14 @@ if uploaded_file is None:
     st.stop()
 
 if run_button:
-    input_path = save_uploaded_file(uploaded_file)
-
     try:
         with st.spinner("กำลังจัดเวรและคำนวณผลลัพธ์..."):
-            scheduler = PharmacistScheduler(
-                input_path,
-                employee_sheet_name=employee_sheet_name,
-                staff_type=staff_type,
-            )
+            # ไฟล์เดิมไม่ต้อง parse ใหม่: ได้ตัวต้นแบบจาก cache แล้ว copy มารัน (state ของแต่ละรอบไม่ปนกัน)
+            scheduler = copy.deepcopy(load_scheduler_template(
+                uploaded_file.getvalue(),
+                employee_sheet_name,
+                staff_type,
+            ))
 
             schedule, unfilled_info = scheduler.optimize_schedule(
                 year=int(year),
@@ -3061,9 +3704,12 @@ if run_button:
                 iterations=int(iterations),
                 true_random_override=bool(true_random_override),
                 enable_run_log=bool(enable_run_log),
+                workers=int(workers),
             )
 
         st.session_state["scheduler"] = scheduler
+        st.session_state.pop("excel_export", None)
+        st.session_state.pop("dashboard_frames", None)
         st.session_state["schedule"] = schedule
         st.session_state["unfilled_info"] = unfilled_info
         st.session_state["enable_run_log"] = enable_run_log
@@ -3075,11 +3721,6 @@ if run_button:
     except Exception as exc:
         st.error("รันโปรแกรมไม่สำเร็จ")
         st.exception(exc)
-    finally:
-        try:
-            os.remove(input_path)
-        except OSError:
-            pass
 
 if "schedule" not in st.session_state:
     st.stop()
@@ -3090,9 +3731,7 @@ unfilled_info = st.session_state["unfilled_info"]
 enable_run_log = st.session_state["enable_run_log"]
 mode = st.session_state["mode"]
 
-hour_summary = make_hour_summary(scheduler, schedule)
-unfilled_df = make_unfilled_df(unfilled_info)
-daily_long_df = make_daily_long_df(schedule)
+hour_summary, unfilled_df, daily_long_df = get_dashboard_frames(scheduler, schedule, unfilled_info)
 
 st.markdown('<div class="section-title">Dashboard Summary</div>', unsafe_allow_html=True)
 col1, col2, col3, col4, col5 = st.columns(5)
@@ -3170,7 +3809,7 @@ with tab5:
         st.info("ยังไม่มี run logs หรือไม่ได้เปิด Export Run Log")
 
 st.markdown('<div class="section-title">Download Output</div>', unsafe_allow_html=True)
-excel_bytes = export_schedule_to_bytes(scheduler, schedule, unfilled_info, enable_run_log)
+excel_bytes = get_export_bytes_cached(scheduler, schedule, unfilled_info, enable_run_log)
 file_name = f"{mode}_Schedule_{st.session_state['year']}_{st.session_state['month']:02d}.xlsx"
 st.download_button(
     label="⬇️ Download formatted Excel schedule",
@@ -2,6 +2,17 @@ import streamlit as st
 import pandas as pd
 import io
 
+# ชื่อคอลัมน์จาก SAP -> ชื่อที่ใช้ในไฟล์ผลลัพธ์ และลำดับคอลัมน์สุดท้าย
+ZTRF_RENAMES = {
+    "Goods Receipt/Issue Slip": "Reservation",
+    "Material Document": "Mat Doc",
+    "Storage location": "คลังจ่าย",
+    "Receiving stor. loc.": "คลังรับ",
+    "Base Unit of Measure": "หน่วย",
+    "Quantity": "จำนวน"
+}
+ZTRF_OUTPUT_COLUMNS = ["Mat Doc", "Posting Date", "Reservation", 'Material', 'Material description', 'Batch', "จำนวน", 'คลังจ่าย', 'คลังรับ']
+
 # --- ฟังก์ชันสำหรับประมวลผลข้อมูล ---
 # แยกส่วนการประมวลผลออกมาเป็นฟังก์ชันเพื่อให้โค้ดอ่านง่ายขึ้น
 def process_data(df, sloc):
@@ -16,27 +27,19 @@ def process_data(df, sloc):
     checkerdf = checkerdf[checkerdf["Reference"] > 0]
     checkerdf = checkerdf.rename(columns={"Reference": "Material Document", "Material Document": "Reference"})
     
-    df_processed = df.groupby(["Goods Receipt/Issue Slip", "Material", "Material description", "Batch"])["Quantity"].sum().reset_index()
+    # ผลรวมที่จะ merge ผ่านได้ต้องมี Reservation อยู่ใน filterdf จึงตัดแถวอื่นทิ้งก่อน groupby ให้ข้อมูลเล็กลง
+    relevant = df[df["Goods Receipt/Issue Slip"].isin(filterdf["Goods Receipt/Issue Slip"])]
+    df_processed = relevant.groupby(["Goods Receipt/Issue Slip", "Material", "Material description", "Batch"])["Quantity"].sum().reset_index()
     df_processed = df_processed[df_processed['Quantity'] < 0].reset_index(drop=True)
     df_processed = pd.merge(df_processed, filterdf, how='inner').drop(columns=['Reference', 'Movement type', 'Plant'])
     df_processed = pd.merge(df_processed, checkerdf, how='left').drop_duplicates()
     
-    # การเปลี่ยนชื่อคอลัมน์
-    df_processed = df_processed.rename(columns={
-        "Goods Receipt/Issue Slip": "Reservation", 
-        "Material Document": "Mat Doc", 
-        "Storage location": "คลังจ่าย", 
-        "Receiving stor. loc.": "คลังรับ",
-        "Base Unit of Measure": "หน่วย", 
-        "Quantity": "จำนวน"
+    # เปลี่ยนชื่อ เลือกคอลัมน์สุดท้าย แล้วแปลงจำนวน/วันที่ ในขั้นเดียว (ไม่สร้าง DataFrame กลางทางหลายชุด)
+    df_processed = df_processed.rename(columns=ZTRF_RENAMES).reset_index(drop=True)[ZTRF_OUTPUT_COLUMNS]
+    df_processed = df_processed.assign(**{
+        'จำนวน': df_processed['จำนวน'].abs(),
+        'Posting Date': pd.to_datetime(df_processed['Posting Date']).dt.strftime('%d.%m.%Y'),
     })
-    
-    df_processed = df_processed.reset_index(drop=True)
-    df_processed['จำนวน'] = df_processed['จำนวน'].abs()
-    
-    # จัดเรียงและเลือกคอลัมน์สุดท้าย
-    df_processed = df_processed[["Mat Doc", "Posting Date", "Reservation", 'Material', 'Material description', 'Batch', "จำนวน", 'คลังจ่าย', 'คลังรับ']]
-    df_processed['Posting Date'] = pd.to_datetime(df_processed['Posting Date']).dt.strftime('%d.%m.%Y')
 
     # กรองตามรหัสคลัง (sloc) ที่ผู้ใช้ป้อน
     if sloc.lower() != 'all':